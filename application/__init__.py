@@ -1,10 +1,12 @@
 from flask import Flask  
+import os
 
 from .custom.data import Data
 from .custom.nlp import NLP
 from .custom.db import UserDB, OfferDB
-from .custom.api import NTNE, APEC
+from .custom.api import BaseAPI, NTNE, APEC, RatePolicy, ResponseCache
 from .custom.plot import Plot
+from .custom.jobs import JobRunner
 
 
 class AppContext(Flask):
@@ -13,8 +15,10 @@ class AppContext(Flask):
     offer_db: OfferDB
     ntne_api: NTNE
     apec_api: APEC
+    apis: dict[str, BaseAPI]
     nlp: NLP
     plot: Plot
+    jobs: JobRunner
 
 
 def create_app():
@@ -27,10 +31,24 @@ def create_app():
         app.data = Data()
         app.user_db = UserDB()
         app.offer_db = OfferDB()
-        app.ntne_api = NTNE()
-        app.apec_api = APEC()
+        # Each job-board client has its own session, they share the request policy (state kept per host) and the response cache
+        policy = RatePolicy()
+        cache = ResponseCache()
+        # Offers are built in separate processes when PARSE_WORKERS > 0
+        parse_workers = int(os.environ.get('PARSE_WORKERS', 0))
+        # Comma separated keywords, searched concurrently on each source
+        keywords = [keyword.strip() for keyword in os.environ.get('CRAWL_KEYWORDS', 'data').split(',') if keyword.strip()] or ['data']
+        app.ntne_api = NTNE(keywords, policy=policy, cache=cache, parse_workers=parse_workers)
+        app.apec_api = APEC(keywords, policy=policy, cache=cache, parse_workers=parse_workers)
+        # Registered sources, crawled together by the ingest job
+        app.apis = {
+            'NTNE': app.ntne_api,
+            'APEC': app.apec_api
+        }
         app.nlp = NLP()
         app.plot = Plot()
+        # Crawls and NLP processing run in background threads, independently of the requests
+        app.jobs = JobRunner(workers=int(os.environ.get('JOB_WORKERS', 4)))
 
     # Init pages routes
     from .routes import main as main_blueprint
@@ -0,0 +1,101 @@
+"""Offline ingestion benchmark: `iter_search` -> `OfferDB.add` on recorded responses.
+
+Record fixtures once (live requests):
+    python -m application._process.benchmark_ingestion --source NTNE --record --max-offers 500
+
+Then replay them with simulated network conditions:
+    python -m application._process.benchmark_ingestion --source NTNE --max-offers 500 --latency .2 --error-rate .05 --workers 16
+"""
+
+import argparse
+import tempfile
+import time
+import os
+
+from application.custom.api import NTNE, APEC, RatePolicy
+from application.custom.api.replay import RecordingSession, ReplaySession
+from application.custom.db import OfferDB
+from application._process.create_offer_bd import create_schema
+
+
+SOURCES = {
+    'NTNE': NTNE,
+    'APEC': APEC
+}
+
+
+def record(source:str, fixtures:str, max_offers:int) -> None:
+    api = SOURCES[source]()
+    api.session = RecordingSession(api.session, fixtures)
+    count = 0
+    for _ in api.iter_search():
+        count += 1
+        if count >= max_offers:
+            break
+    print(f'Recorded {count} {source} offers in {fixtures}')
+
+
+def replay(source:str, fixtures:str, max_offers:int, workers:int, batch:int, latency:float, jitter:float, error_rate:float) -> dict:
+    # Write in a throwaway database
+    os.environ['DATA_PATH'] = tempfile.mkdtemp(prefix='naturaljob_bench_')
+    os.makedirs(os.path.join(os.environ['DATA_PATH'], 'db'))
+    db = OfferDB()
+    with db.connect() as conn:
+        create_schema(conn)
+    db.migrate()
+
+    # Loose policy so that only the simulated server shapes the throughput
+    policy = RatePolicy(rate=1000, burst=1000, max_rate=1000, concurrency=workers, max_concurrency=workers, backoff=.01, failure_threshold=1000)
+    api = SOURCES[source](workers=workers, policy=policy)
+    api.session = session = ReplaySession(fixtures, latency=latency, jitter=jitter, error_rate=error_rate, seed=0)
+
+    count = 0
+    insert_time = 0.
+    offers = []
+    tic = time.perf_counter()
+    for offer in api.iter_search():
+        offers.append(offer)
+        count += 1
+        if len(offers) >= batch or count >= max_offers:
+            t = time.perf_counter()
+            db.add(offers)
+            insert_time += time.perf_counter() - t
+            offers = []
+        if count >= max_offers:
+            break
+    if offers:
+        t = time.perf_counter()
+        db.add(offers)
+        insert_time += time.perf_counter() - t
+    elapsed = time.perf_counter() - tic
+
+    return {
+        'offers': count,
+        'seconds': round(elapsed, 3),
+        'offers_per_second': round(count / elapsed, 1) if elapsed else None,
+        'insert_seconds': round(insert_time, 3),
+        'requests': session.calls,
+        'missing_fixtures': session.misses
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', choices=SOURCES, required=True)
+    parser.add_argument('--fixtures', help='Fixtures directory. Defaults to data/fixtures/<source>')
+    parser.add_argument('--record', action='store_true', help='Record live responses instead of replaying')
+    parser.add_argument('--max-offers', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.)
+    parser.add_argument('--jitter', type=float, default=0.)
+    parser.add_argument('--error-rate', type=float, default=0.)
+    args = parser.parse_args()
+
+    fixtures = args.fixtures or os.path.join('data', 'fixtures', args.source)
+    if args.record:
+        record(args.source, fixtures, args.max_offers)
+    else:
+        result = replay(args.source, fixtures, args.max_offers, args.workers, args.batch, args.latency, args.jitter, args.error_rate)
+        for key, value in result.items():
+            print(f'{key:>18}: {value}')
@@ -0,0 +1,83 @@
+"""Check `ParseHTML` engines give the same text, and time them.
+
+Uses the HTML fields of recorded fixtures (see `benchmark_ingestion.py`) when available, built-in samples otherwise:
+    python -m application._process.benchmark_parser --fixtures data/fixtures/APEC
+"""
+
+import argparse
+import timeit
+import json
+import os
+
+from application.custom.utils.parser import ParseHTML
+
+
+# Description fields of the job-board payloads
+HTML_FIELDS = ('texteHtml', 'texteHtmlProfil', 'texteHtmlEntreprise', 'description', 'profileDescription', 'companyDescription')
+
+SAMPLES = [
+    "<p>Rattaché(e) au <strong>Head of Data</strong>, vous&nbsp;intervenez sur :</p>\n<ul><li>la modélisation (dbt, Snowflake)</li><li>les tableaux de bord Power&nbsp;BI</li></ul>",
+    "<div>Salaire : 45 k&euro; &ndash; 55 k&#8364;<br/>T&eacute;l&eacute;travail partiel<!-- tag --></div>",
+    "<p>Entreprise &amp; culture</p><style>p { color: red; }</style><script>var x = 1;</script><p>Lyon &lt;69&gt;</p>",
+    "Texte sans balise, avec un &unknown; et un &#150; hérité",
+]
+
+
+def collect(fixtures:str) -> list[str]:
+    htmls = []
+    for name in sorted(os.listdir(fixtures)):
+        with open(os.path.join(fixtures, name), 'r', encoding='utf-8') as f:
+            fixture = json.load(f)
+        try:
+            body = json.loads(fixture['body'])
+        except (ValueError, TypeError):
+            continue
+        if isinstance(body, dict):
+            results = body.get('content') or body.get('resultats') or [body]
+        else:
+            results = body if isinstance(body, list) else []
+        for result in results:
+            if isinstance(result, dict):
+                htmls.extend(result[key] for key in HTML_FIELDS if result.get(key))
+    return htmls
+
+
+def check(htmls:list[str]) -> int:
+    mismatches = 0
+    for html in htmls:
+        expected = ParseHTML(html, engine='soup')
+        if ParseHTML._parse_stream(html) != expected:
+            mismatches += 1
+            print('MISMATCH:', html[:120])
+    return mismatches
+
+
+def bench(htmls:list[str], number:int) -> dict:
+    ParseHTML._parse_cached.cache_clear()
+    soup = timeit.timeit(lambda: [ParseHTML(html, engine='soup') for html in htmls], number=number)
+    stream = timeit.timeit(lambda: [ParseHTML._parse_stream(html) for html in htmls], number=number)
+    cached = timeit.timeit(lambda: [ParseHTML(html) for html in htmls], number=number)
+    calls = len(htmls) * number
+    return {
+        'documents': len(htmls),
+        'soup_us_per_doc': round(soup / calls * 1e6, 1),
+        'stream_us_per_doc': round(stream / calls * 1e6, 1),
+        'cached_us_per_doc': round(cached / calls * 1e6, 1),
+        'speedup': round(soup / stream, 2) if stream else None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', help='Fixtures directory recorded by benchmark_ingestion')
+    parser.add_argument('--number', type=int, default=20, help='Timing repetitions')
+    args = parser.parse_args()
+
+    htmls = collect(args.fixtures) if args.fixtures else []
+    htmls = htmls or SAMPLES
+
+    mismatches = check(htmls)
+    print(f'{mismatches} mismatch(es) on {len(htmls)} documents')
+    for key, value in bench(htmls, args.number).items():
+        print(f'{key:>18}: {value}')
+    raise SystemExit(1 if mismatches else 0)
@@ -1,12 +1,3 @@
-import sqlean as sqlite3
-import sqlite_vec
-
-connection = sqlite3.connect("data/db/offer.db")
-connection.enable_load_extension(True)
-sqlite_vec.load(connection)
-connection.execute("PRAGMA foreign_keys = ON;")
-cursor = connection.cursor()
-
 schema_statements = [
     """
     CREATE TABLE IF NOT EXISTS COMPANY (
@@ -49,8 +40,16 @@ schema_statements = [
     """
     CREATE VIRTUAL TABLE IF NOT EXISTS TFIDF
     USING vec0(
-        emb_50d  FLOAT[50],
-        emb_3d   FLOAT[3]
+        source         TEXT PARTITION KEY,
+        emb_50d        FLOAT[50] distance_metric=cosine,
+        emb_3d         FLOAT[3],
+        salary_min     FLOAT,
+        city_id        INTEGER,
+        region_id      INTEGER,
+        company_id     INTEGER,
+        cluster_id     INTEGER,
+        contract_type  TEXT,
+        date           TEXT
     );
     """,
     """
@@ -68,6 +67,7 @@ schema_statements = [
         longitude      REAL,
         date           TEXT,
         source         TEXT NOT NULL,
+        external_id    TEXT,
         description_id INTEGER NOT NULL,
         city_id        INTEGER NOT NULL,
         company_id     INTEGER NOT NULL,
@@ -109,11 +109,39 @@ schema_statements = [
         FOREIGN KEY (offer_id) REFERENCES OFFER(offer_id)  ON DELETE CASCADE,
         FOREIGN KEY (skill_id) REFERENCES SKILL(skill_id)
     );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS CHECKPOINT (
+        source        TEXT PRIMARY KEY,
+        stop_date     TEXT,
+        offset        INTEGER NOT NULL DEFAULT 0,
+        last_date     TEXT,
+        last_offer_id INTEGER,
+        updated_at    TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
     """
+    # Indexes and natural key constraints are added by the migrations (`custom/db/offer/migrations.py`),
+    # applied when the app starts
 ]
 
-for stmt in schema_statements:
-    cursor.execute(stmt)
 
-connection.commit()
-connection.close()
\ No newline at end of file
+
+def create_schema(connection) -> None:
+    """Create the offer tables on a connection (sqlite-vec must be loaded)"""
+
+    cursor = connection.cursor()
+    for stmt in schema_statements:
+        cursor.execute(stmt)
+    connection.commit()
+
+
+if __name__ == '__main__':
+    import sqlean as sqlite3
+    import sqlite_vec
+
+    connection = sqlite3.connect("data/db/offer.db")
+    connection.enable_load_extension(True)
+    sqlite_vec.load(connection)
+    connection.execute("PRAGMA foreign_keys = ON;")
+    create_schema(connection)
+    connection.close()
\ No newline at end of file
@@ -5,7 +5,9 @@ import numpy as np
 from typing import cast
 
 from . import AppContext
+from . import tasks
 from .custom.db.user.models import Template
+from .custom.jobs import Job
 
 
 # Cast app_context typing
@@ -13,6 +15,9 @@ app = cast(AppContext, current_app)
 # Create blueprint
 ajax = Blueprint('ajax', __name__)
 
+# Every NLP job rewrites the model files (process_nlp saves the TF-IDF matrix, the fits replace the models): one at a time
+NLP_LEASES = ['nlp']
+
 
 
 
@@ -124,14 +129,14 @@ def bdd_info(source:str):
     if source not in {'NTNE', 'APEC'}:
         abort(404, description='Invalid source')
 
-    total = app.offer_db.get_total(source=source)
-    latest_date = app.offer_db.get_latest_date(source=source, isostring=True)
-    rows = app.offer_db.summary(source=source)
-    
+    # Kept up to date on ingest, no scan of the offers here
+    stats = app.offer_db.get_stats(source=source)
+
     return jsonify({
-        'total': total,
-        'date': latest_date or 'NA',
-        'summary': rows
+        'total': stats['total'],
+        'date': stats['date'] or 'NA',
+        'summary': stats['summary'],
+        'profile': app.offer_db.get_profile()
     })
 
 @ajax.route('/update_bdd_stream/<source>')
@@ -139,38 +144,49 @@ def update_bdd_stream(source: str):
     if source not in {'NTNE', 'APEC'}:
         abort(404, description='Invalid source')
 
-    
-    def event_stream():
-        db_total = app.offer_db.get_total(source=source)
-        latest_date = app.offer_db.get_latest_date(source=source)
+    # The crawl runs as a background job, this stream only follows it (`?job=<id>` to follow an existing one)
+    job_id = request.args.get('job')
+    if not job_id:
+        # A crawl of this source already running (eg. started from another tab) is followed instead
+        job_id = app.jobs.submit('ingest', tasks.ingest, app._get_current_object(), source, key=source, single_flight=True).job_id
+    return stream_job(job_id)
 
-        if source == 'NTNE':
-            api_total = app.ntne_api.get_total()
-            iterator = app.ntne_api.iter_search(stop_date=latest_date)
-        else:
-            api_total = app.apec_api.get_total()
-            iterator = app.apec_api.iter_search(stop_date=latest_date)
 
-        total = 0
-        step = 1 / (api_total - db_total)
-        offers = []
+@ajax.route('/update_all_stream')
+def update_all_stream():
+    # Every registered source is crawled at once, in a single job
+    job_id = request.args.get('job')
+    if not job_id:
+        sources = list(app.apis)
+        # Holds the lease of every source, a crawl of any of them already running is followed instead
+        leases = [f'ingest:{source}' for source in sources]
+        job_id = app.jobs.submit('ingest', tasks.ingest, app._get_current_object(), sources, key='all', single_flight=True, leases=leases).job_id
+    return stream_job(job_id)
 
-        try:
-            for offer in iterator:
-                offers.append(offer)
-                total += 1
-                yield f"data: {json.dumps({'count': total, 'progress': total*step*100})}\n\n"
 
-            # Add remaining batch
-            if offers:
-                app.offer_db.add(offers)
+@ajax.route('/jobs/<job_id>')
+def get_job(job_id:str):
+    job = app.jobs.get(job_id)
+    if job is None:
+        abort(404, description='Unknown job')
+    return jsonify(job.to_dict())
 
-            db_total = app.offer_db.get_total(source=source)
-            yield "event: end\ndata: complete\n\n"
 
-        except Exception as exc:
-            yield f"event: error\ndata: {json.dumps({'message': str(exc)})}\n\n"
-            raise
+@ajax.route('/jobs/<job_id>/stream')
+def stream_job(job_id:str):
+    if app.jobs.get(job_id) is None:
+        abort(404, description='Unknown job')
+
+    def event_stream():
+        for job in app.jobs.subscribe(job_id):
+            if job is None:
+                yield ": keepalive\n\n"
+            elif job.status == 'done':
+                yield f"event: end\ndata: {json.dumps({'job_id': job.job_id, 'result': job.result})}\n\n"
+            elif job.finished:
+                yield f"event: error\ndata: {json.dumps({'job_id': job.job_id, 'message': job.error or job.status})}\n\n"
+            elif job.progress:
+                yield f"data: {json.dumps({'job_id': job.job_id, **job.progress})}\n\n"
 
     headers = {
         'Cache-Control': 'no-cache',
@@ -185,23 +201,18 @@ def process_nlp(source:str):
     if source not in {'NTNE', 'APEC'}:
         abort(404, description='Invalid source')
 
-    ids, descriptions = app.offer_db.get_unprocessed(source)
-    if not ids:
-        return jsonify({"success": True})
-    
-    emb_50d, emb_3d = app.nlp.tfidf.transform(descriptions, save=True)
-    labels, clusters = app.nlp.kmeans.predict(emb_50d)
+    # Runs in background: the client follows the returned job (`/jobs/<id>` or `/jobs/<id>/stream`)
+    job = submit_nlp('process_nlp', tasks.process_nlp, source, key=source)
+    return jsonify(job.to_dict()), 202
 
-    with app.offer_db.connect() as conn:
-        for id, emb50, emb3, cluster_id in zip(ids, emb_50d, emb_3d, labels):
-            for cluster in clusters:
-                if cluster.id == cluster_id:
-                    c = cluster
-                    break
-            app.offer_db.add_nlp(conn, id, emb_50d=emb50, emb_3d=emb3, cluster=c)
-        conn.commit()
 
-    return jsonify({"success": True})
+def submit_nlp(kind:str, fn, *args, key:str) -> Job:
+    # Every NLP job holds the NLP lease: the running one is followed only when it is the same operation on the same
+    # arguments, 409 otherwise (its result would be taken for the one asked)
+    job = app.jobs.submit(kind, fn, app._get_current_object(), *args, key=key, single_flight=True, leases=NLP_LEASES)
+    if (job.kind, job.key) != (kind, key):
+        abort(409, description=f'Another NLP job is running ({job.kind} {job.key or ""}), retry once it is finished')
+    return job
 
 
 @ajax.route('fit_kmeans', methods=['POST'])
@@ -210,33 +221,9 @@ def fit_kmeans():
     if not K:
         abort(400, 'Missing required parameter "K"')
 
-    ids = app.offer_db.get_table('OFFER', columns=['offer_id'])
-    emb_50ds = app.offer_db.get_table('TFIDF', columns=['emb_50d'], convert_blob=True)
-    X, tokens = app.nlp.tfidf.load_matrix()
-    labels, clusters = app.nlp.kmeans.fit_predict(X, emb_50ds, tokens, K=K)
-
-    # Create cluster names
-    template = [{
-        'cluster_id': c.id,
-        'main_tokens': c.main_tokens,
-        'cluster_name': None
-    } for c in clusters]
-    response = app.nlp.llm.request_json(
-        "Je fais du clustering d'offres d'emploi dans la data. Je me base sur les descriptions des offres. Trouve des noms pour mes clusters selon les tokens principaux.",
-        json_template=template
-    )
-    for c in response:
-        cluster_id = c['cluster_id']
-        clusters[cluster_id].name = c['cluster_name']
-
-    # Save data
-    with app.offer_db.connect() as conn:
-        app.offer_db.clear_table(conn, 'CLUSTER')
-        for id, cluster_id in zip(ids, labels):
-            c = clusters[cluster_id]
-            app.offer_db.add_nlp(conn, id, cluster=c)
-
-    return jsonify(app.nlp.kmeans.metadata)
+    # Single-flight: the same fit already running (any worker) is returned instead of started twice
+    job = submit_nlp('fit_kmeans', tasks.fit_kmeans, K, key=f'K={K}')
+    return jsonify(job.to_dict()), 202
 
 @ajax.route('fit_tfidf', methods=['POST'])
 def fit_tfidf():
@@ -244,17 +231,10 @@ def fit_tfidf():
     max_df = float(request.form.get('max_df'))
     if not all([min_df, max_df]):
         abort(400, 'Missing required parameter "min_df" and / or "max_df"')
-        
-    offers, ids = app.offer_db.get_offers()
-    descriptions = [offer.description.offer_description for offer in offers]
-    emb_50d, emb_3d = app.nlp.tfidf.fit_transform(descriptions, min_df=min_df, max_df=max_df)
-
-    with app.offer_db.connect() as conn:
-        app.offer_db.clear_table(conn, 'TFIDF')
-        for offer_id, emb50, emb3 in zip(ids, emb_50d, emb_3d):
-            app.offer_db.add_nlp(conn, offer_id, emb_50d=emb50, emb_3d=emb3)
 
-    return jsonify(app.nlp.tfidf.metadata)
+    # Single-flight: concurrent NLP jobs would race on the vectorizer and matrix files
+    job = submit_nlp('fit_tfidf', tasks.fit_tfidf, min_df, max_df, key=f'min_df={min_df},max_df={max_df}')
+    return jsonify(job.to_dict()), 202
 
 
 @ajax.route('get_models_metadata')
@@ -284,11 +264,15 @@ def search_offer():
     near = []
 
     # create filters
-    for key in ['salary', 'category', 'company', 'city']:
+    for key in ['salary', 'category', 'company', 'city', 'region', 'contract', 'source', 'since']:
         if request.args.get(key):
             filters.append({key: request.args.get(key)})
+    # 'vector' (embeddings), 'text' (full-text index) or 'hybrid' (both, rank fusion)
+    mode = request.args.get('mode', 'vector')
+    if mode not in {'vector', 'text', 'hybrid'}:
+        abort(400, description='Invalid mode')
     # create query embeddings
-    if request.args.get('query'):
+    if request.args.get('query') and mode != 'text':
         emb, _ = app.nlp.tfidf.transform([request.args.get('query')])
         query = emb
     # create resume embeddings
@@ -298,9 +282,9 @@ def search_offer():
         emb, _ = app.nlp.tfidf.transform([template_text])
         resume = emb
     # create refines (like and dislikes)
-    if request.args.get('refine'):
+    if request.args.get('refine') and mode != 'text':
         print('args: ', f"|{request.args.get('refine')}|", flush=True)
-        with app.offer_db.connect() as conn:
+        with app.offer_db.connect(read_only=True) as conn:
             for refine in json.loads(request.args.get('refine')):
                 offer_id = refine['offer_id']
                 emb, _ = app.offer_db.get_nlp(conn, offer_id)
@@ -321,7 +305,19 @@ def search_offer():
         # normalize the query if has been adjusted (divide by its L2 norm)
         query = query / np.linalg.norm(query)
 
-    offers, ids, scores = app.offer_db.search_offer(query=query, resume=resume, filters=filters)
+    # KNN candidates, and page of results among them
+    k = request.args.get('k', type=int)
+    limit = request.args.get('limit', type=int)
+    page = request.args.get('page', default=0, type=int)
+    if any(value is not None and value < 1 for value in (k, limit)) or page < 0:
+        abort(400, description='Invalid k, limit or page')
+
+    try:
+        offers, ids, scores = app.offer_db.search_offer(
+            query=query, resume=resume, filters=filters, k=k, limit=limit, page=page, text=request.args.get('query'), mode=mode
+        )
+    except ValueError as e:
+        abort(400, description=f'Invalid filter: {e}')
     offer_htmls = [offer.render(id, score=score, style='result') for offer, id, score in zip(offers, ids, scores)]
     return jsonify(offer_htmls)
 
@@ -1,2 +1,5 @@
+from .base_api import BaseAPI
 from .ntne import NTNE
-from .apec import APEC
\ No newline at end of file
+from .apec import APEC
+from .policy import RatePolicy, CircuitOpenError
+from .cache import ResponseCache
\ No newline at end of file
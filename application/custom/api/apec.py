@@ -1,9 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import Counter
 from datetime import date
+from typing import Callable, Generator, Iterable, Any
 import json
 
 from .base_api import BaseAPI
+from .policy import RatePolicy
+from .cache import ResponseCache
+from .mapping import OfferMapping, Field, values_of, iso_date
 from ..utils.parser import XPathSearch, ParseHTML, ParseNumeric
-from ..db.offer.models import Offer, Description, Company, City, Region
+from ..db.offer.models import Offer, Checkpoint
+
+
+
+
+def _lookup(category:str) -> Callable[[Any, dict], str|None]:
+    # Label of a hierarchy id (the hierarchy is the crawl context)
+    def transform(id:Any, hierarchy:dict) -> str|None:
+        if not id:
+            return None
+        return hierarchy.get(category, {}).get(id)
+    return transform
+
+
+def _experience(id:Any, hierarchy:dict) -> int|None:
+    experience = _lookup('OFFRE_NIVEAU_EXPERIENCE')(id, hierarchy)
+    if not experience:
+        return None
+    year = ParseNumeric(experience)
+    return year[0] if year else None
+
+
+def _salary(index:int|None) -> Callable[[str|None], Any]:
+    # Salary label if `index` is None, else the min (0) / max (1) amount
+    def transform(label:str|None) -> Any:
+        if not label or label.lower() == 'a négocier':
+            return None
+        if index is None:
+            return label
+        amounts = ParseNumeric(label)
+        if len(amounts) >= index+1:
+            return amounts[index] * 1000
+        return None
+    return transform
+
+
+def _job_type(part_time:Any) -> str:
+    return 'PART_TIME' if part_time else 'FULL_TIME'
+
+
+def _region_code(postal_code:str|None) -> str|None:
+    return postal_code[:2] if postal_code else None
+
+
+def _prefix(prefix:str) -> Callable[[str|None], str|None]:
+    return lambda url: prefix + url if url else None
 
 
 
@@ -18,15 +69,44 @@ class APEC(BaseAPI):
         'hierarchy': '/referentielstatique/presentations/visuels/liste/hierarchie',
         'offer': '/offre/public'
     }
+    cache_ttl = {
+        'hierarchy': 7 * 24 * 3600,
+        'offer': 24 * 3600
+    }
     headers = {
         'User-Agent': "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36",
         'Accept': 'application/json, text/plain, */*',
         'Accept-Encoding': 'gzip, deflate, br, zstd',
         'Origin': 'https://www.apec.fr'
     }
+    mapping = OfferMapping(
+        fields={
+            'title': Field('intitule'),
+            'job_name': Field('intitule'),
+            'job_type': Field('idNomDureeTempsPartiel', warning=False, transform=_job_type),
+            'contract_type': Field('idNomTypeContrat', transform=_lookup('RECHERCHE_OFFRE_TYPE_CONTRAT'), context=True),
+            'salary_label': Field('salaireTexte', transform=_salary(None)),
+            'salary_min': Field('salaireTexte', transform=_salary(0)),
+            'salary_max': Field('salaireTexte', transform=_salary(1)),
+            'min_experience': Field('idNomNiveauExperience', transform=_experience, context=True),
+            'latitude': Field('latitude'),
+            'longitude': Field('longitude'),
+            'date': Field('datePublication', transform=iso_date),
+            'skills': Field('competences', transform=values_of('libelle')),
+            'description.offer_description': Field('texteHtml', transform=ParseHTML),
+            'description.profile_description': Field('texteHtmlProfil', transform=ParseHTML),
+            'company.name': Field('enseigne'),
+            'company.description': Field('texteHtmlEntreprise', transform=ParseHTML),
+            'company.industry': Field('idNomSecteurActivite', transform=_lookup('NAF_700_SERVICE_DOMAIN'), context=True),
+            'company.logo_url': Field('logoEtablissement', transform=_prefix(domain + '/files/live/mounts/images')),
+            'region.code': Field('adresseOffre', 'adresseCodePostal', warning=False, transform=_region_code),
+            'city.name': Field('adresseOffre', 'adresseVille', warning=False),
+        },
+        constants={'source': 'APEC', 'region.name': None}
+    )
 
-    def __init__(self, keyword="data") -> None:
-        super().__init__(self.base_url, keyword=keyword, headers=self.headers)
+    def __init__(self, keyword:str|Iterable[str]="data", workers:int=None, policy:RatePolicy=None, cache:ResponseCache=None, parse_workers:int=None) -> None:
+        super().__init__(self.base_url, keyword=keyword, headers=self.headers, workers=workers, policy=policy, cache=cache, parse_workers=parse_workers)
 
     def __parse_date(self, result:dict) -> date|None:
         date_str = XPathSearch(result, 'datePublication')
@@ -34,137 +114,60 @@ class APEC(BaseAPI):
             return None
         return date.fromisoformat(date_str[:10])
 
-
-    def __parse_region_code(self, result:int) -> int|None:
-        postal_code = XPathSearch(result, 'adresseOffre', 'adresseCodePostal', warning=False)
-        if not postal_code:
-            return None
-        return postal_code[:2]
-    
-    def __parse_industry(self, result:dict, hierarchy:dict) -> str|None:
-        industry_id = XPathSearch(result, 'idNomSecteurActivite')
-        if not industry_id:
-            return None
-        industry = XPathSearch(hierarchy, 'NAF_700_SERVICE_DOMAIN', industry_id)
-        return industry
-    
-    def __parse_job_type(self, result:dict) -> str:
-        if result.get('idNomDureeTempsPartiel'):
-            return 'PART_TIME'
-        return 'FULL_TIME'
-    
-    def __parse_contract_type(self, result:dict, hierarchy:dict) -> str|None:
-        contract_id = XPathSearch(result, 'idNomTypeContrat')
-        if not contract_id:
-            return None
-        contract_type = XPathSearch(hierarchy, 'RECHERCHE_OFFRE_TYPE_CONTRAT', contract_id)
-        return contract_type
-    
-    def __parse_salary(self, result:dict, source='label') -> float|None:
-        label = XPathSearch(result, 'salaireTexte')
-        if label.lower() == 'a négocier':
-            return None
-        
-        if source == 'label':
-            return label
-        
-        keys = {
-            'min': 0,
-            'max': 1
+    def _search_payload(self, keyword:str, start_index:int=0, page_size:int=None) -> dict:
+        return {
+            "lieux": [],
+            "fonctions": [],
+            "statutPoste": [],
+            "typesContrat": [],
+            "typesConvention": ["143684", "143685", "143686", "143687", "143706"],
+            "niveauxExperience": [],
+            "idsEtablissement": [],
+            "secteursActivite": [],
+            "typesTeletravail": [],
+            "idNomZonesDeplacement": [],
+            "positionNumbersExcluded": [],
+            "typeClient": "CADRE",
+            "sorts": [{"type": "DATE", "direction": "DESCENDING"}],
+            "pagination": {"range": self.size if page_size is None else page_size, "startIndex": start_index},
+            "activeFiltre": True,
+            "pointGeolocDeReference": {"distance": 0},
+            "motsCles": keyword,
         }
-        index = keys.get(source)
-        if index is None:
-            raise ValueError("Unexpected `source` value, should be in ('label', 'min', 'max)")
-        
-        amounts = ParseNumeric(label)
-        if len(amounts) >= index+1:
-            return amounts[index] * 1000
-        return None
-        
-    def __parse_experience(self, result:dict, hierarchy:dict) -> str|None:
-        experience_id = XPathSearch(result, 'idNomNiveauExperience')
-        if not experience_id:
-            return None
-        experience = XPathSearch(hierarchy, 'OFFRE_NIVEAU_EXPERIENCE', experience_id)
-        year = ParseNumeric(experience)
-        if not year:
-            return None
-        return year[0]
-    
-    def __parse_company_logo(self, result) -> str|None:
-        url = XPathSearch(result, 'logoEtablissement')
-        if not url:
-            return None
-        return self.domain + '/files/live/mounts/images' + url
-
-
-    def __create_offer(self, result:dict, hierarchy:dict) -> Offer:
-        description = Description(
-            offer_description = ParseHTML(XPathSearch(result, 'texteHtml')),
-            profile_description = ParseHTML(XPathSearch(result, 'texteHtmlProfil')),
-        )
-        company = Company(
-            name = XPathSearch(result, 'enseigne'),
-            description = ParseHTML(XPathSearch(result, 'texteHtmlEntreprise')),
-            industry = self.__parse_industry(result, hierarchy),
-            logo_url = self.__parse_company_logo(result)
-        )
-        region = Region(
-            code = self.__parse_region_code(result),
-            name = None
-        )
-        city = City(
-            name = XPathSearch(result, 'adresseOffre', 'adresseVille', warning=False),
-            region = region
-        )
-
-        skills = []
-        skills_list = XPathSearch(result, 'competences')
-        if skills_list is not None:
-            for skill_element in skills_list:
-                skill = XPathSearch(skill_element, 'libelle')
-                if skill:
-                    skills.append(skill)
-
-        return Offer(
-            title = XPathSearch(result, 'intitule'),
-            job_name = XPathSearch(result, 'intitule'),
-            job_type = self.__parse_job_type(result),
-            contract_type = self.__parse_contract_type(result, hierarchy),
-            salary_label = self.__parse_salary(result, source='label'),
-            salary_min = self.__parse_salary(result, source='min'),
-            salary_max = self.__parse_salary(result, source='max'),
-            min_experience = self.__parse_experience(result, hierarchy),
-            latitude = XPathSearch(result, 'latitude'),
-            longitude = XPathSearch(result, 'longitude'),
-            date = self.__parse_date(result).isoformat(),
-            source = 'APEC',
-            description = description,
-            company = company,
-            city = city
-        )
-
-    def _loop_recent(self, url:str, payload:dict, stop_date:date|None) -> list[str]:
-        job_ids = []
+
+    def _iter_recent(self, url:str, payload:dict, stop_date:date|None, known:Callable[[list[str]], set[str]]=None) -> Generator[tuple[int, str], Any, None]:
         while True:
             # Request content and skip if empty (reached end)
             content = self._safe_requests(url, method='POST', json=payload)
             if len(content['resultats']) == 0:
-                break
+                return
             # Check if stop date reached
+            offset = payload['pagination']['startIndex']
+            job_ids = []
+            reached = False
             for result in content['resultats']:
                 publish_date = self.__parse_date(result)
                 if stop_date and publish_date <= stop_date:
-                    return job_ids
+                    reached = True
+                    break
                 job_ids.append(result['numeroOffre'])
+            # Skip offers already in database before downloading their details
+            known_ids = known(job_ids) if known and job_ids else set()
+            for id in job_ids:
+                if id not in known_ids:
+                    yield offset, id
+            if reached:
+                return
             # Next page
             payload['pagination']['startIndex'] += self.size
 
-        return job_ids
-    
     def _collect_hierarchy(self, url, payload) -> dict:
         # Request latest hierarchy json
-        content = self._safe_requests(url, method='POST', json=payload)
+        try:
+            content = self._safe_requests(url, method='POST', json=payload)
+        except Exception as e:
+            print(f'WARNING: {e}')
+            content = None
         # Load from backup if fails
         if not content:
             print('WARNING: Failed to collect APEC hierarchy. Getting it from `data/dist/apec_hierarchy.json`')
@@ -181,95 +184,136 @@ class APEC(BaseAPI):
             key_map[category][key] = value
         return key_map
     
-    def _iter_content(self, url:str, params:dict, job_ids:list[str], hierarchy:dict):
-        for id in job_ids:
-            params['numeroOffre'] = id
-            result = self._safe_requests(url, method='GET', params=params, raise_status=False)
-            if not result:
-                print(f'WARNING: APEC job {id} not found')
-                continue # skip if no response
-            yield self.__create_offer(result, hierarchy)
-
-    def iter_search(self, stop_date:date=None):
-        """Loop search on APEC job API from most recent to a specific date. First collect recent offer IDs, then request individual content.
+    def _fetch_content(self, url:str, params:dict, id:str) -> dict|None:
+        params = {**params, 'numeroOffre': id}
+        return self._safe_requests(url, method='GET', params=params, raise_status=False)
+
+    def _iter_content(self, url:str, params:dict, job_ids:Iterable[tuple[int, str]], hierarchy:Future[dict], checkpoint:Checkpoint=None) -> Generator[Offer, Any, None]:
+        # Fetch details concurrently, results still come back in `job_ids` order
+        results = self._map_ordered(lambda job: (*job, self._fetch_content(url, params, job[1])), job_ids)
+
+        # Parse processes get a search page of results at once (shipping each offer alone costs more than parsing it)
+        size = self.size if self.parse_workers else 1
+
+        def found() -> Generator[tuple[list[tuple[int, str]], list[dict]], Any, None]:
+            tags, batch = [], []
+            for offset, id, result in results:
+                if not result:
+                    print(f'WARNING: APEC job {id} not found')
+                    continue # skip if no response
+                if batch and (offset != tags[-1][0] or len(batch) >= size):
+                    yield tags, batch
+                    tags, batch = [], []
+                tags.append((offset, id))
+                batch.append(result)
+            if batch:
+                yield tags, batch
+
+        offers = self._iter_offers(found(), context=hierarchy)
+        try:
+            for tags, built in offers:
+                for (offset, id), offer in zip(tags, built):
+                    if checkpoint:
+                        checkpoint.offset = offset
+                    offer.external_id = id
+                    yield offer
+        finally:
+            offers.close()
+            results.close()
+
+    def _iter_merged(self, url:str, keywords:tuple[str], stop_date:date|None, known:Callable[[list[str]], set[str]]=None, counts:Counter=None) -> Generator[tuple[int, str], Any, None]:
+        # Keywords are searched concurrently, offers found by several keywords are only fetched once
+        searches = {keyword: self._iter_recent(url, self._search_payload(keyword), stop_date, known=known) for keyword in keywords}
+        merged = self._merge_concurrent(searches)
+        seen = set()
+        try:
+            for keyword, (_, id) in merged:
+                if counts is not None:
+                    counts[keyword] += 1
+                if id not in seen:
+                    seen.add(id)
+                    # Offset 0: pages of different keywords cannot be resumed from a single one
+                    yield 0, id
+        finally:
+            merged.close()
+
+    def iter_search(self, stop_date:date=None, checkpoint:Checkpoint=None, known:Callable[[list[str]], set[str]]=None, keywords:Iterable[str]=None, counts:Counter=None) -> Generator[Offer, Any, None]:
+        """Loop search on APEC job API from most recent to a specific date. Offer IDs are streamed page by page
+        to the detail stage, while the hierarchy is collected alongside the first search page.
+        With several keywords, searches run concurrently and their IDs are de-duplicated before fetching details.
 
         Args:
             stop_date (date): The date to stop the search. Parse all jobs if `None`.
+            checkpoint (Checkpoint, optional): Resume from `checkpoint.offset`, kept up to date with the offset of the last yielded offer (single keyword only).
+            known (Callable, optional): Returns the IDs (`numeroOffre`) already stored among a list, these offers are skipped.
+            keywords (Iterable[str], optional): Keywords to search. Defaults to the client keywords.
+            counts (Counter, optional): Filled with the number of new offers found by each keyword.
 
-        Return
-            (list[dict]): The concatened json response
+        Yields:
+            Offer: The parsed offers, most recent first for a single keyword
         """
 
         # Search recent job IDs
         search_url = self.base_url + self.endpoints['search']
-        payload = {
-            "lieux": [],
-            "fonctions": [],
-            "statutPoste": [],
-            "typesContrat": [],
-            "typesConvention": ["143684", "143685", "143686", "143687", "143706"],
-            "niveauxExperience": [],
-            "idsEtablissement": [],
-            "secteursActivite": [],
-            "typesTeletravail": [],
-            "idNomZonesDeplacement": [],
-            "positionNumbersExcluded": [],
-            "typeClient": "CADRE",
-            "sorts": [{"type": "DATE", "direction": "DESCENDING"}],
-            "pagination": {"range": self.size, "startIndex": 0},
-            "activeFiltre": True,
-            "pointGeolocDeReference": {"distance": 0},
-            "motsCles": "data",
-        }
-        job_ids = self._loop_recent(search_url, payload, stop_date)
+        keywords = tuple(dict.fromkeys(keywords)) if keywords else self.keywords
+        if len(keywords) == 1:
+            keyword, = keywords
+            payload = self._search_payload(keyword, start_index=checkpoint.offset if checkpoint else 0)
+            job_ids = self._iter_recent(search_url, payload, stop_date, known=known)
+            if counts is not None:
+                job_ids = self.__count(job_ids, counts, keyword)
+        else:
+            job_ids = self._iter_merged(search_url, keywords, stop_date, known=known, counts=counts)
 
         # Get hierarchy map (json containing id labels)
         hierarchy_url = self.base_url + self.endpoints['hierarchy']
-        payload = {
+        hierarchy_payload = {
             'codesPresentations': [
                 'NAF_700_SERVICE_DOMAIN',
                 'RECHERCHE_OFFRE_TYPE_CONTRAT',
                 'OFFRE_NIVEAU_EXPERIENCE'
             ]
         }
-        hierarchy = self._collect_hierarchy(hierarchy_url, payload)
 
         # Get individual content
         offer_url = self.base_url + self.endpoints['offer']
         params = {
             'numeroOffre' : None
         }
-        yield from self._iter_content(offer_url, params, job_ids, hierarchy)
-    
-    def get_total(self) -> int|None:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Hierarchy runs in background, search pages are pulled lazily by the detail stage
+            hierarchy = executor.submit(self._collect_hierarchy, hierarchy_url, hierarchy_payload)
+            try:
+                yield from self._iter_content(offer_url, params, job_ids, hierarchy, checkpoint=checkpoint)
+            finally:
+                job_ids.close()
+                self._report_missing()
+
+    @staticmethod
+    def __count(job_ids:Iterable[tuple[int, str]], counts:Counter, keyword:str) -> Generator[tuple[int, str], Any, None]:
+        for job in job_ids:
+            counts[keyword] += 1
+            yield job
+
+    def get_total(self, keyword:str=None) -> int|None:
         """Get total of result on API
 
+        Args:
+            keyword (str, optional): Keyword to count. Sum of every client keyword if `None` (offers matching several keywords are counted once per keyword).
+
         Returns:
             int|None: Total result
         """
 
+        if keyword is None:
+            totals = list(self._map_ordered(self.get_total, self.keywords))
+            if all(total is None for total in totals):
+                return None
+            return sum(total or 0 for total in totals)
+
         url = self.base_url + self.endpoints['search']
-        payload = {
-            "lieux": [],
-            "fonctions": [],
-            "statutPoste": [],
-            "typesContrat": [],
-            "typesConvention": ["143684", "143685", "143686", "143687", "143706"],
-            "niveauxExperience": [],
-            "idsEtablissement": [],
-            "secteursActivite": [],
-            "typesTeletravail": [],
-            "idNomZonesDeplacement": [],
-            "positionNumbersExcluded": [],
-            "typeClient": "CADRE",
-            "sorts": [{"type": "DATE", "direction": "DESCENDING"}],
-            "pagination": {"range": 0, "startIndex": 0},
-            "activeFiltre": True,
-            "pointGeolocDeReference": {"distance": 0},
-            "motsCles": "data",
-        }
+        payload = self._search_payload(keyword, page_size=0)
         result = self._safe_requests(url, method='POST', json=payload)
         if not result:
             return None
         return result.get('totalCount')
-
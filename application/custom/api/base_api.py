@@ -1,9 +1,42 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor, Future
+from collections import deque, Counter
+from itertools import chain
+from functools import partial
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+import multiprocessing
+import threading
 import time
 
 import requests
 from curl_cffi import requests as cffi_requests
 
+from .policy import RatePolicy
+from .cache import ResponseCache
+from .mapping import OfferMapping
+from ..utils.concurrency import merge_concurrent
+from ..db.offer.models import Offer
+
+
+
+T = TypeVar('T')
+R = TypeVar('R')
+K = TypeVar('K')
+
+
+_parse_context = None # crawl context of a parse process, set once by the pool initializer
+
+
+def _init_parse(context:Any) -> None:
+    global _parse_context
+    _parse_context = context
+
+
+def _build_offers(api:type['BaseAPI'], payloads:list[dict]) -> tuple[list[Offer], Counter]:
+    # Runs in a parse process: the mapping is looked up on the class (compiled accessors cannot be pickled),
+    # missing fields are sent back with the offers since the process counters are not shared
+    offers = api.mapping.build_many(payloads, _parse_context)
+    return offers, api.mapping.pop_missing()
 
 
 
@@ -13,9 +46,25 @@ class BaseAPI(ABC):
         'User-Agent': "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36"
     }
 
-    def __init__(self, base_url:str, keyword="data", headers:dict=None, cffi=False) -> None:
+    endpoints = {}
+    mapping: OfferMapping = None # how source results are turned into `Offer` objects
+    cache_ttl = {} # endpoint name -> seconds a response stays fresh, not cached if missing
+    workers = 8
+    parse_workers = 0 # processes building offers, 0 to build them in the crawl thread
+    policy = RatePolicy() # shared by every client unless overridden
+
+    def __init__(self, base_url:str, keyword:str|Iterable[str]="data", headers:dict=None, cffi=False, workers:int=None, policy:RatePolicy=None, cache:ResponseCache=None, parse_workers:int=None) -> None:
         self.base_url = base_url
-        self.keyword = keyword
+        # One or several search keywords, crawled concurrently and merged
+        self.keywords = (keyword,) if isinstance(keyword, str) else tuple(dict.fromkeys(keyword))
+        self.keyword = self.keywords[0]
+        self.workers = workers or self.workers
+        self.parse_workers = parse_workers if parse_workers is not None else self.parse_workers
+        self.policy = policy or self.policy
+        self.cache = cache
+        self._parse_pool = None
+        self._parse_context = None
+        self._parse_lock = threading.Lock()
         self.session = self.__create_session(cffi)
         self.session.headers = headers or self.headers
 
@@ -24,34 +73,222 @@ class BaseAPI(ABC):
             return cffi_requests.Session()
         return requests.Session()
 
-    def _safe_requests(self, url:str, method='GET', raise_status=True, _tic=0, **kwargs) -> dict|None:
-        """Make a requests with exeption and retries
+    def _get_cache_ttl(self, url:str) -> float|None:
+        if self.cache is None:
+            return None
+        for endpoint, ttl in self.cache_ttl.items():
+            if url == self.base_url + self.endpoints[endpoint]:
+                return ttl
+        return None
+
+    def _safe_requests(self, url:str, method='GET', raise_status=True, **kwargs) -> dict|None:
+        """Make a requests through the rate policy, with exponential backoff retries on transient failures.
+        Responses of endpoints listed in `cache_ttl` are served from the response cache while fresh, and revalidated with
+        conditional requests (ETag / Last-Modified) once stale.
 
         Args:
             method (str): Method to use on request ('GET', 'POST', 'PUT', 'DELETE'). Defaults to 'GET'.
+            raise_status (bool): Raise on error status, return None otherwise. Defaults to True.
 
         Return:
-            (Response): The response json output
+            (dict|None): The response json output
+
+        Raises:
+            CircuitOpenError: If the host failed too many times recently
         """
 
         method = method.upper()
         if method not in ['GET', 'POST', 'PUT', 'DELETE']:
             raise ValueError(f"Unsupported method: {method}. Should be in ('GET', 'POST', 'PUT', 'DELETE')")
 
-        try:
-            response = self.session.request(method, url, **kwargs)
-            if response.status_code in [200, 400]:
-                return response.json()
-            elif raise_status:
+        ttl = self._get_cache_ttl(url)
+        cached = None
+        if ttl:
+            key = self.cache.make_key(method, url, kwargs.get('params'), kwargs.get('json'))
+            cached = self.cache.get(key)
+            if cached and cached.fresh:
+                return cached.json()
+            if cached:
+                kwargs['headers'] = {**(kwargs.get('headers') or {}), **cached.conditional_headers()}
+
+        host = self.policy.host(url)
+        error = None
+        retry_after = None
+        for attempt in range(self.policy.retries + 1):
+            if attempt:
+                time.sleep(self.policy.delay(attempt - 1, retry_after))
+            retry_after = None
+
+            host.acquire()
+            tic = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.RequestException, cffi_requests.RequestsError) as e:
+                host.failure()
+                error = f'Request failed: {e}'
+                continue
+            except BaseException:
+                # Says nothing about the host, but must not leave a circuit trial open
+                host.cancel()
+                raise
+            finally:
+                # Any other exception must not leak the slot either
+                host.release()
+
+            status = response.status_code
+            if status == 429 or status >= 500:
+                # Transient, retry after the delay asked by the server (if any)
+                if status in (429, 503):
+                    host.congestion()
+                else:
+                    host.failure()
+                retry_after = response.headers.get('Retry-After')
+                error = f'Request failed ({status}): {url}'
+                continue
+
+            if status == 304 and cached:
+                # Not modified, keep the stored body
+                host.success(time.monotonic() - tic)
+                self.cache.refresh(key, ttl)
+                return cached.json()
+
+            if 200 <= status < 300:
+                host.success(time.monotonic() - tic)
+                content = response.json() if response.content else None
+                if ttl and content is not None:
+                    self.cache.set(
+                        key, content, ttl,
+                        etag=response.headers.get('ETag'),
+                        last_modified=response.headers.get('Last-Modified')
+                    )
+                return content
+
+            host.done()
+            if raise_status:
                 response.raise_for_status()
             return None
-        except requests.RequestException as e:
-            if _tic < 3:
-                time.sleep(.5)
-                return self._safe_requests(url, method, raise_status=raise_status, _tic=_tic+1, **kwargs)
-            else:
-                raise Exception(f'Request failed ({response.status_code}): {e}')
-            
+
+        if raise_status:
+            raise Exception(error)
+        return None
+
+    def _map_ordered(self, fn:Callable[[T], R], items:Iterable[T], workers:int=None, executor:Executor=None) -> Iterator[R]:
+        """Apply `fn` on items with a bounded pool, yielding results in input order.
+
+        At most `workers` calls are in flight at once, so `items` can be a lazy iterator.
+
+        Args:
+            fn (Callable): The function to call on each item (usually doing a request)
+            items (Iterable): The items to process
+            workers (int, optional): Max concurrent calls. Defaults to `self.workers`
+            executor (Executor, optional): Pool running the calls (`fn` must be picklable for a process pool). A thread pool of `workers` by default
+
+        Yields:
+            The results of `fn`, in the same order as `items`
+        """
+
+        workers = workers or self.workers
+        if executor is None:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                yield from self.__iter_window(executor, fn, items, workers)
+        else:
+            yield from self.__iter_window(executor, fn, items, workers)
+
+    @staticmethod
+    def __iter_window(executor:Executor, fn:Callable[[T], R], items:Iterable[T], window:int) -> Iterator[R]:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(fn, item))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Consumer stopped early (or failed): drop what has not started yet
+            for future in pending:
+                future.cancel()
+
+    def _merge_concurrent(self, iterators:dict[K, Iterable[T]], buffer:int=None) -> Iterator[tuple[K, T]]:
+        """Drain several iterators in parallel threads (see `merge_concurrent`), with a buffer of `self.workers` items by default"""
+
+        return merge_concurrent(iterators, buffer=buffer or self.workers)
+
+    def _get_parse_pool(self, context:Any=None) -> ProcessPoolExecutor:
+        with self._parse_lock:
+            if self._parse_pool is not None and self._parse_context != context:
+                # The context is shipped once to each process, a new one needs new processes
+                self._parse_pool.shutdown(cancel_futures=True)
+                self._parse_pool = None
+            if self._parse_pool is None:
+                # 'spawn' since crawls run in threads of the web server, forking them is unsafe
+                self._parse_pool = ProcessPoolExecutor(
+                    max_workers=self.parse_workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_parse, initargs=(context,)
+                )
+                self._parse_context = context
+            return self._parse_pool
+
+    def _iter_offers(self, items:Iterable[tuple[T, list[dict]]], context:Any|Future=None) -> Iterator[tuple[T, list[Offer]]]:
+        """Parse stage: build offers from raw source results, in the crawl thread or in a process pool (`parse_workers`).
+
+        Batches are built in input order, with at most twice `parse_workers` batches in flight, so `items` is only
+        pulled as fast as offers are consumed.
+
+        Args:
+            items (Iterable[tuple]): (tag, results) batches, the tag is given back untouched (eg. page number)
+            context (Any | Future, optional): Crawl context given to the mapping, resolved on the first batch when a `Future`
+                (sent once to each parse process, not with every batch)
+
+        Yields:
+            tuple: (tag, offers) in the same order as `items`
+        """
+
+        items = iter(items)
+        first = next(items, None)
+        if first is None:
+            return
+        if isinstance(context, Future):
+            context = context.result()
+        items = chain([first], items)
+
+        if not self.parse_workers:
+            for tag, payloads in items:
+                yield tag, self.mapping.build_many(payloads, context)
+            return
+
+        # Tags stay in this process, only the results are shipped
+        tags = deque()
+        def payloads() -> Iterator[list[dict]]:
+            for tag, batch in items:
+                tags.append(tag)
+                yield batch
+
+        build = partial(_build_offers, type(self))
+        batches = self._map_ordered(build, payloads(), workers=2 * self.parse_workers, executor=self._get_parse_pool(context))
+        try:
+            for offers, missing in batches:
+                self.mapping.add_missing(missing)
+                yield tags.popleft(), offers
+        finally:
+            batches.close()
+
+    def close(self) -> None:
+        """Shut the parse processes down"""
+
+        with self._parse_lock:
+            if self._parse_pool is not None:
+                self._parse_pool.shutdown(cancel_futures=True)
+                self._parse_pool = None
+                self._parse_context = None
+
+    def _report_missing(self) -> None:
+        """Print the fields missing since the last report (one line per crawl instead of one per offer)"""
+
+        missing = self.mapping.pop_missing()
+        if missing:
+            print(f'WARNING: {self.__class__.__name__} missing fields', dict(missing))
+
     @abstractmethod
     def iter_search(self):
         ...
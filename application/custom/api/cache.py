@@ -0,0 +1,130 @@
+from contextlib import closing
+from dataclasses import dataclass
+import hashlib
+import sqlite3
+import json
+import time
+import os
+
+
+
+
+@dataclass
+class CacheEntry:
+    body: str
+    etag: str|None
+    last_modified: str|None
+    expires_at: float
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def json(self) -> dict:
+        return json.loads(self.body)
+
+    def conditional_headers(self) -> dict:
+        """Validators to send when revalidating a stale entry"""
+
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+
+
+class ResponseCache:
+
+    """Persistent HTTP response cache (sqlite), keyed by method, url, params and body"""
+
+    path = 'cache/http.db'
+    stale_ttl = 30 * 24 * 3600 # keep expired entries with validators this long for revalidation
+
+    def __init__(self) -> None:
+        root = os.environ.get('DATA_PATH', 'data/')
+        self.db_path = os.path.join(root, self.path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.__init_table()
+        self.purge()
+
+    def __init_table(self) -> None:
+        with closing(self.connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS RESPONSE (
+                    key           TEXT PRIMARY KEY,
+                    body          TEXT NOT NULL,
+                    etag          TEXT,
+                    last_modified TEXT,
+                    expires_at    REAL NOT NULL,
+                    stored_at     REAL NOT NULL
+                )
+            """)
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @staticmethod
+    def make_key(method:str, url:str, params:dict=None, body:dict=None) -> str:
+        """Build the cache key of a request
+
+        Args:
+            method (str): The request method
+            url (str): The request url
+            params (dict, optional): Query parameters
+            body (dict, optional): JSON body
+
+        Returns:
+            str: The request hash
+        """
+
+        raw = json.dumps([method.upper(), url, params, body], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key:str) -> CacheEntry|None:
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                "SELECT body, etag, last_modified, expires_at FROM RESPONSE WHERE key = ?", [key]
+            ).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def set(self, key:str, content:dict, ttl:float, etag:str=None, last_modified:str=None) -> None:
+        now = time.time()
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO RESPONSE(key, body, etag, last_modified, expires_at, stored_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [key, json.dumps(content), etag, last_modified, now + ttl, now]
+            )
+
+    def refresh(self, key:str, ttl:float) -> None:
+        """Extend an entry after the server confirmed it did not change (304)"""
+
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                "UPDATE RESPONSE SET expires_at = ? WHERE key = ?", [time.time() + ttl, key]
+            )
+
+    def purge(self) -> int:
+        """Delete expired entries that cannot be revalidated anymore
+
+        Returns:
+            int: Number of deleted entries
+        """
+
+        now = time.time()
+        with closing(self.connect()) as conn, conn:
+            cur = conn.execute(
+                """
+                DELETE FROM RESPONSE
+                WHERE expires_at < ?
+                AND (etag IS NULL AND last_modified IS NULL OR expires_at < ?)
+                """,
+                [now, now - self.stale_ttl]
+            )
+            return cur.rowcount
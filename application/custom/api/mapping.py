@@ -0,0 +1,177 @@
+from collections import Counter
+from typing import Any, Callable
+import threading
+
+from ..db.offer.models import Offer, Description, Company, City, Region
+
+
+
+
+class Field:
+
+    """Declarative field: where to read a value in a source payload, and how to convert it"""
+
+    def __init__(self, *xpath:str|list[int], transform:Callable=None, context=False, warning=True, fallback:'Field'=None) -> None:
+        """Declare a field
+
+        Args:
+            *xpath (str, list[int]): Path of the value in the payload (same syntax as `XPathSearch`), the whole payload if empty
+            transform (Callable, optional): Function applied on the value. Default to None
+            context (bool): Call `transform(value, context)` with the crawl context (eg. APEC hierarchy). Defaults to False
+            warning (bool): Count the field as missing when the path cannot be walked. Defaults to True
+            fallback (Field, optional): Field used when the value is falsy. Default to None
+        """
+
+        self.xpath = xpath
+        self.transform = transform
+        self.context = context
+        self.warning = warning
+        self.fallback = fallback
+
+
+
+
+def _step(inner:Callable[[Any], Any], key:str|list[int]) -> Callable[[Any], Any]:
+    # One more key of the path, applied on the value read by `inner`
+    if isinstance(key, list):
+        index = key[0]
+        return lambda payload: inner(payload)[index]
+    return lambda payload: inner(payload).get(key)
+
+
+def compile_xpath(xpath:tuple) -> Callable[[dict], Any]:
+    """Compile an xpath into a chain of accessor closures (no per-call key inspection)
+
+    Args:
+        xpath (tuple): Keys (dict) and `[index]` (list) to walk
+
+    Returns:
+        Callable: `accessor(payload)`, raising (KeyError, IndexError, AttributeError, TypeError) when the path breaks
+    """
+
+    accessor = lambda payload: payload
+    for key in xpath:
+        accessor = _step(accessor, key)
+    return accessor
+
+
+
+
+class OfferMapping:
+
+    """Source mapping (offer field -> `Field`), compiled once into accessors building `Offer` objects.
+
+    Field names are the `Offer` attributes, nested objects use a prefix: 'description.', 'company.', 'city.', 'region.'.
+    """
+
+    nested = ('description', 'company', 'city', 'region')
+
+    def __init__(self, fields:dict[str, Field], constants:dict[str, Any]=None) -> None:
+        """Compile a mapping
+
+        Args:
+            fields (dict[str, Field]): Offer field name -> declared field
+            constants (dict, optional): Offer field name -> constant value (eg. the source name)
+        """
+
+        self.constants = constants or {}
+        self.fields = [(name, self.__compile(field)) for name, field in fields.items()]
+        self.missing = Counter()
+        self._lock = threading.Lock()
+
+    def __compile(self, field:Field) -> tuple:
+        fallback = self.__compile(field.fallback) if field.fallback else None
+        return compile_xpath(field.xpath), field.transform, field.context, field.warning, fallback
+
+    def __read(self, name:str, compiled:tuple, payload:dict, context:Any, missing:list[str]) -> Any:
+        accessor, transform, use_context, warning, fallback = compiled
+        try:
+            value = accessor(payload)
+        except (KeyError, IndexError, AttributeError, TypeError):
+            if warning:
+                missing.append(name)
+            value = None
+        if not value and fallback:
+            return self.__read(name, fallback, payload, context, missing)
+        if transform is None:
+            return value
+        if use_context:
+            return transform(value, context)
+        return transform(value)
+
+    def values(self, payload:dict, context:Any=None) -> dict[str, Any]:
+        """Read every field of a payload
+
+        Args:
+            payload (dict): A source result
+            context (Any, optional): Crawl context given to the transforms declared with `context=True`
+
+        Returns:
+            dict[str, Any]: Offer field name -> value
+        """
+
+        missing = []
+        values = dict(self.constants)
+        for name, compiled in self.fields:
+            values[name] = self.__read(name, compiled, payload, context, missing)
+        self.add_missing(missing)
+        return values
+
+    def build(self, payload:dict, context:Any=None) -> Offer:
+        """Build an `Offer` from a source result"""
+
+        values = self.values(payload, context)
+        nested = {prefix: {} for prefix in self.nested}
+        offer = {}
+        for name, value in values.items():
+            prefix, _, attribute = name.partition('.')
+            if attribute:
+                nested[prefix][attribute] = value
+            else:
+                offer[name] = value
+
+        return Offer(
+            **offer,
+            description=Description(**nested['description']),
+            company=Company(**nested['company']),
+            city=City(region=Region(**nested['region']), **nested['city'])
+        )
+
+    def build_many(self, payloads:list[dict], context:Any=None) -> list[Offer]:
+        """Build offers from a page of source results"""
+
+        return [self.build(payload, context) for payload in payloads]
+
+    def add_missing(self, missing:list[str]|Counter) -> None:
+        """Count missing fields (eg. the counters sent back by a parse process)"""
+
+        if missing:
+            with self._lock:
+                self.missing.update(missing)
+
+    def pop_missing(self) -> Counter:
+        """Return the missing fields counters and reset them"""
+
+        with self._lock:
+            missing, self.missing = self.missing, Counter()
+        return missing
+
+
+
+
+def values_of(key:str) -> Callable[[list[dict]|None], list]:
+    """Transform collecting the truthy `key` of each element of a list (eg. skills labels)"""
+
+    def transform(elements:list[dict]|None) -> list:
+        if not elements:
+            return []
+        return [element[key] for element in elements if element.get(key)]
+    return transform
+
+
+def iso_date(value:str|None) -> str|None:
+    """Transform an ISO datetime string to an ISO date string"""
+
+    if not value:
+        return None
+    return value[:10]
@@ -1,9 +1,53 @@
 from datetime import date
-from typing import Generator, Any
+from collections import Counter
+from itertools import count
+from typing import Callable, Generator, Iterable, Any
 
 from .base_api import BaseAPI
+from .policy import RatePolicy
+from .cache import ResponseCache
+from .mapping import OfferMapping, Field, values_of, iso_date
 from ..utils.parser import ParseHTML, XPathSearch, ParseNumeric
-from ..db.offer.models import Offer, Description, Company, City, Region
+from ..db.offer.models import Offer, Checkpoint
+
+
+
+
+def _salary_label(label:str|None) -> str|None:
+    if not label or label.lower() == 'salaire selon profil':
+        return None
+    return label
+
+
+def _annual_salary(key:str) -> Callable[[dict|None], float|None]:
+    def transform(salary:dict|None) -> float|None:
+        # Parse salary and return if None
+        amount = salary.get(key) if salary else None
+        if not amount:
+            return None
+        # Convert to annual period
+        match salary.get('period'):
+            case 'MONTH':
+                amount = amount * 12
+            case 'HOUR':
+                amount = amount * 35 * 52
+        return amount
+    return transform
+
+
+def _min_experience(label:str|None) -> int|None:
+    if not label:
+        return None
+    numbers = ParseNumeric(label)
+    return min(numbers) if numbers else None
+
+
+def _prefix(prefix:str) -> Callable[[str|None], str|None]:
+    return lambda url: prefix + url if url else None
+
+
+def _as_str(value:Any) -> str|None:
+    return str(value) if value is not None else None
 
 
 
@@ -20,9 +64,42 @@ class NTNE(BaseAPI):
         "Accept-Language": "en-US,en;q=0.9",
         "Referer": "https://nostalentsnosemplois.auvergnerhonealpes.fr/",
     }
+    limits = (100, 50, 20) # page sizes to try, the API may reject the larger ones
+    prefetch = 2 # pages requested ahead of the one being parsed
+    mapping = OfferMapping(
+        fields={
+            'title': Field('title'),
+            'job_name': Field('mainJob', 'label', warning=False, fallback=Field('unknownJob')),
+            'job_type': Field('jobType', [0]),
+            'contract_type': Field('contractTypes', [0]),
+            'salary_label': Field('labels', 'salary', 'value', transform=_salary_label),
+            'salary_min': Field('salary', transform=_annual_salary('from')),
+            'salary_max': Field('salary', transform=_annual_salary('to')),
+            'min_experience': Field('labels', 'experienceLevelList', [0], 'value', warning=False, transform=_min_experience),
+            'latitude': Field('locations', [0], 'lat'),
+            'longitude': Field('locations', [0], 'lon'),
+            'date': Field('publicationDate', transform=iso_date),
+            'external_id': Field('id', transform=_as_str),
+            'degrees': Field('labels', 'degreeList', transform=values_of('value')),
+            'skills': Field('labels', 'specializationList', transform=values_of('value')),
+            'description.offer_description': Field('description', transform=ParseHTML),
+            'description.profile_description': Field('profileDescription', transform=ParseHTML),
+            'company.name': Field('company', 'name'),
+            'company.description': Field('companyDescription', transform=ParseHTML),
+            'company.industry': Field('company', 'industryField', 'value'),
+            'company.logo_url': Field('url', 'logo', transform=_prefix(domain)),
+            'region.code': Field('locations', [0], 'admin2Code'),
+            'region.name': Field('locations', [0], 'admin2Label'),
+            'city.name': Field('locations', [0], 'admin3Label'),
+        },
+        constants={'source': 'NTNE'}
+    )
+
+    def __init__(self, keyword:str|Iterable[str]="data", workers:int=None, policy:RatePolicy=None, cache:ResponseCache=None, parse_workers:int=None):
+        super().__init__(self.base_url, keyword=keyword, headers=self.headers, cffi=True, workers=workers, policy=policy, cache=cache, parse_workers=parse_workers)
 
-    def __init__(self, keyword="data"):
-        super().__init__(self.base_url, keyword=keyword, headers=self.headers, cffi=True)
+    def __parse_id(self, result:dict) -> str|None:
+        return _as_str(XPathSearch(result, 'id'))
 
     def __parse_date(self, result:dict) -> date|None:
         # Parse date
@@ -32,153 +109,162 @@ class NTNE(BaseAPI):
         # Convert to iso date
         return date.fromisoformat(date_str[:10])
 
-    
-    def __parse_salary(self, result:dict, source='label') -> float|None:
-        # Parse and return salary label
-        if source == 'label':
-            label = XPathSearch(result, 'labels', 'salary', 'value')
-            if label.lower() == 'salaire selon profil':
-                return None
-            return label
-        
-        _match = {
-            'min': 'from',
-            'max': 'to'
-        }
-        # Raise exeption if unexpected `source` value
-        key = _match.get(source)
-        if not key:
-            raise ValueError("Unexpected `source` value, should be in ('label', 'min', 'max)")
-        # Parse salary and return if None
-        salary = XPathSearch(result, 'salary', key)
-        if not salary:
-            return None
-        # Convert to annual period
-        period = XPathSearch(result, 'salary', 'period')
-        match period:
-            case 'MONTH':
-                salary = salary * 12
-            case 'HOUR':
-                salary = salary * 35 * 52
+    def _fetch_page(self, url:str, params:dict, page:int) -> list[dict]:
+        content = self._safe_requests(url, method='GET', params={**params, 'page': page})
+        return content['content']
 
-        return salary
-    
-    def __parse_experience(self, result:dict) -> int|None:
-        label = XPathSearch(result, 'labels', 'experienceLevelList', [0], 'value', warning=False)
-        if not label:
-            return None
-        numbers = ParseNumeric(label)
-        return min(numbers)
-    
-    def __parse_company_logo(self, result) -> str|None:
-        url = XPathSearch(result, 'url', 'logo')
-        if not url:
-            return None
-        return self.domain + url
-
-    def __create_offer(self, result:dict) -> Offer:
-        description = Description(
-            offer_description = ParseHTML(XPathSearch(result, 'description')),
-            profile_description = ParseHTML(XPathSearch(result, 'profileDescription')),
-        )
-        company = Company(
-            name = XPathSearch(result, 'company', 'name'),
-            description = ParseHTML(XPathSearch(result, 'companyDescription')),
-            industry = XPathSearch(result, 'company', 'industryField', 'value'),
-            logo_url = self.__parse_company_logo(result)
-        )
-        region = Region(
-            code = XPathSearch(result, 'locations', [0], 'admin2Code'),
-            name = XPathSearch(result, 'locations', [0], 'admin2Label')
-        )
-        city = City(
-            name = XPathSearch(result, 'locations', [0], 'admin3Label'),
-            region = region
-        )
-
-        degrees = []
-        degrees_list = XPathSearch(result, 'labels', 'degreeList')
-        if degrees_list is not None:
-            for degree_element in degrees_list:
-                degree = XPathSearch(degree_element, 'value')
-                if degree:
-                    degrees.append(degree)
-
-        skills = []
-        skills_list = XPathSearch(result, 'labels', 'specializationList')
-        if skills_list is not None:
-            for skill_element in skills_list:
-                skill = XPathSearch(skill_element, 'value')
-                if skill:
-                    skills.append(skill)
-
-        return Offer(
-            title = XPathSearch(result, 'title'),
-            job_name = XPathSearch(result, 'mainJob', 'label', warning=False) or XPathSearch(result, 'unknownJob'),
-            job_type = XPathSearch(result, 'jobType', [0]),
-            contract_type = XPathSearch(result, 'contractTypes', [0]),
-            salary_label = self.__parse_salary(result, source='label'),
-            salary_min = self.__parse_salary(result, source='min'),
-            salary_max = self.__parse_salary(result, source='max'),
-            min_experience = self.__parse_experience(result),
-            latitude = XPathSearch(result, 'locations', [0], 'lat'),
-            longitude = XPathSearch(result, 'locations', [0], 'lon'),
-            date = (d := self.__parse_date(result)) and d.isoformat(),
-            source = 'NTNE',
-            description = description,
-            company = company,
-            city = city,
-            skills=skills,
-            degrees=degrees
-        )
-
-    def _iter_recent(self, url: str, params: dict, stop_date: date | None) -> Generator[Offer, Any, None]:
-        while True:
-            content = self._safe_requests(url, method='GET', params=params)
-            if not content['content']:
-                return
-
-            for result in content['content']:
-                publish_date = self.__parse_date(result)
-                if stop_date and publish_date <= stop_date:
-                    return
-                yield self.__create_offer(result)
-
-            params['page'] += 1
+    def _pick_limit(self, url:str, params:dict, total:int|None, offset:int=0) -> tuple[int, list[dict]|None]:
+        # Start with the smallest size covering `total` in one page (or the largest one), then step down
+        fitting = [limit for limit in self.limits if total is not None and limit >= total]
+        candidates = [limit for limit in self.limits if not fitting or limit <= min(fitting)]
+        for limit in candidates:
+            try:
+                page = offset // limit + 1
+                content = self._safe_requests(url, method='GET', params={**params, 'limit': limit, 'page': page})
+            except Exception:
+                continue
+            results = content and content.get('content')
+            if results is None:
+                continue
+            # A size is accepted if the first page comes back full
+            expected = limit if total is None else min(limit, max(total - (page - 1) * limit, 0))
+            if len(results) >= expected:
+                return limit, results
+        return self.limits[-1], None
 
-    def iter_search(self, stop_date: date | None = None) -> Generator[Offer, Any, None]:
-        url = self.base_url + self.endpoints['search']
-        params = {
+    def _search_params(self, keyword:str, page:int=1, limit:int=20) -> dict:
+        return {
             'serjobsearch': True,
             'scoringVersion': 'SERJOBSEARCH',
             'sorting': 'DATE',
             'expandLocations': True,
             'facet': ["cities", "date", "company", "industry", "contract", "job", "macroJob", "jobType", "content_language", "license", "degree", "experienceLevel"],
-            'page': 1,
-            'limit': 20,
-            'what': self.keyword,
+            'page': page,
+            'limit': limit,
+            'what': keyword,
         }
-        yield from self._iter_recent(url, params, stop_date)
 
-    def get_total(self) -> int|None:
+    def _iter_recent(self, url: str, params: dict, stop_date: date | None, first_page:list[dict]=None, known:Callable[[list[str]], set[str]]=None) -> Generator[tuple[int, list[dict]], Any, None]:
+        # Yields (offset, new results) per page, down to the stop date
+        start = params['page']
+
+        def fetch(page:int) -> tuple[int, list[dict]]:
+            if page == start and first_page is not None:
+                return page, first_page
+            return page, self._fetch_page(url, params, page)
+
+        # Next pages are downloaded while the current one is parsed
+        pages = self._map_ordered(fetch, count(start), workers=self.prefetch)
+        try:
+            for page, results in pages:
+                if not results:
+                    return
+                # Skip offers already in database before parsing them
+                known_ids = known([self.__parse_id(result) for result in results]) if known else set()
+                batch = []
+                reached = False
+                for result in results:
+                    publish_date = self.__parse_date(result)
+                    if stop_date and publish_date <= stop_date:
+                        reached = True
+                        break
+                    if self.__parse_id(result) not in known_ids:
+                        batch.append(result)
+                yield (page - 1) * params['limit'], batch
+                if reached:
+                    return
+        finally:
+            pages.close()
+
+    def _iter_keyword(self, url:str, keyword:str, stop_date:date|None, total:int|None=None, offset:int=0, known:Callable[[list[str]], set[str]]=None) -> Generator[tuple[int, list[dict]], Any, None]:
+        # Pages of raw results of one keyword, with the page size picked on its own total
+        params = self._search_params(keyword)
+        if total is None:
+            total = self.get_total(keyword)
+        params['limit'], first_page = self._pick_limit(url, params, total, offset=offset)
+        params['page'] = offset // params['limit'] + 1
+        yield from self._iter_recent(url, params, stop_date, first_page=first_page, known=known)
+
+    def _iter_merged(self, url:str, keywords:tuple[str], stop_date:date|None, known:Callable[[list[str]], set[str]]=None, counts:Counter=None) -> Generator[tuple[None, list[dict]], Any, None]:
+        # Keywords are searched concurrently, offers found by several keywords are only kept once
+        searches = {keyword: self._iter_keyword(url, keyword, stop_date, known=known) for keyword in keywords}
+        merged = self._merge_concurrent(searches)
+        seen = set()
+        try:
+            for keyword, (_, results) in merged:
+                if counts is not None:
+                    counts[keyword] += len(results)
+                batch = []
+                for result in results:
+                    id = self.__parse_id(result)
+                    if id not in seen:
+                        seen.add(id)
+                        batch.append(result)
+                # No offset: pages of different keywords cannot be resumed from a single one
+                yield None, batch
+        finally:
+            merged.close()
+
+    def iter_search(self, stop_date: date | None = None, total:int|None = None, checkpoint:Checkpoint=None, known:Callable[[list[str]], set[str]]=None, keywords:Iterable[str]=None, counts:Counter=None) -> Generator[Offer, Any, None]:
+        """Loop search on NTNE job API from most recent to a specific date, prefetching the next pages.
+        With several keywords, searches run concurrently and their results are de-duplicated before parsing.
+
+        Args:
+            stop_date (date, optional): The date to stop the search. Parse all jobs if `None`.
+            total (int, optional): Total result reported by `get_total`, used to pick the page size. Requested if `None`.
+            checkpoint (Checkpoint, optional): Resume from `checkpoint.offset`, kept up to date with the offset of the last yielded offer (single keyword only).
+            known (Callable, optional): Returns the IDs already stored among a list, these offers are skipped.
+            keywords (Iterable[str], optional): Keywords to search. Defaults to the client keywords.
+            counts (Counter, optional): Filled with the number of new offers found by each keyword.
+
+        Yields:
+            Offer: The parsed offers, most recent first for a single keyword
+        """
+
+        url = self.base_url + self.endpoints['search']
+        keywords = tuple(dict.fromkeys(keywords)) if keywords else self.keywords
+        if len(keywords) == 1:
+            keyword, = keywords
+            offset = checkpoint.offset if checkpoint else 0
+            pages = self._iter_keyword(url, keyword, stop_date, total=total, offset=offset, known=known)
+        else:
+            pages = self._iter_merged(url, keywords, stop_date, known=known, counts=counts)
+            if checkpoint:
+                checkpoint.offset = 0
+
+        offers = self._iter_offers(pages)
+        try:
+            for offset, built in offers:
+                if offset is not None:
+                    if checkpoint:
+                        checkpoint.offset = offset
+                    if counts is not None:
+                        counts[keyword] += len(built)
+                yield from built
+        finally:
+            offers.close()
+            pages.close()
+            self._report_missing()
+
+    def get_total(self, keyword:str=None) -> int|None:
         """Get total of result on API
 
+        Args:
+            keyword (str, optional): Keyword to count. Sum of every client keyword if `None` (offers matching several keywords are counted once per keyword).
+
         Returns:
             int|None: Total result
         """
 
+        if keyword is None:
+            totals = list(self._map_ordered(self.get_total, self.keywords))
+            if all(total is None for total in totals):
+                return None
+            return sum(total or 0 for total in totals)
+
         url = self.base_url + self.endpoints['search']
-        params = {
-            'serjobsearch': True,
-            'scoringVersion': 'SERJOBSEARCH',
-            'sorting': 'DATE',
-            'expandLocations': True,
-            'facet': ["cities", "date", "company", "industry", "contract", "job", "macroJob", "jobType", "content_language", "license", "degree", "experienceLevel"],
-            'page': 1,
-            'limit': 0,
-            'what': self.keyword,
-        }
+        params = self._search_params(keyword, limit=0)
         result = self._safe_requests(url, method='GET', params=params)
         if not result:
             return None
-        return result.get('total')
\ No newline at end of file
+        return result.get('total')
@@ -0,0 +1,302 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+import threading
+import random
+import time
+
+
+
+
+class CircuitOpenError(Exception):
+
+    """Raised when a request is refused because the host circuit is open"""
+
+
+
+
+class TokenBucket:
+
+    """Token bucket limiting the request rate, with an AIMD adjustable refill rate"""
+
+    def __init__(self, rate:float, burst:int, min_rate:float, max_rate:float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> None:
+        """Block until a token is available and consume it"""
+
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def increase(self, step:float) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + step)
+
+    def decrease(self, factor:float) -> None:
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * factor)
+
+
+
+
+class AdaptiveLimiter:
+
+    """Concurrency limiter whose limit follows AIMD: additive increase on fast successes, multiplicative decrease on congestion"""
+
+    def __init__(self, initial:int, minimum:int, maximum:int) -> None:
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def increase(self) -> None:
+        with self._cond:
+            # Roughly +1 slot per full window of successful requests
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def decrease(self, factor:float) -> None:
+        with self._cond:
+            self.limit = max(self.minimum, self.limit * factor)
+
+
+
+
+class CircuitBreaker:
+
+    """Fail fast after consecutive failures, then let a single trial request through once `reset_timeout` elapsed"""
+
+    def __init__(self, threshold:int, reset_timeout:float) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            match self.state:
+                case 'closed':
+                    return True
+                case 'half-open' if not self.trial:
+                    self.trial = True
+                    return True
+                case _:
+                    return False
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+    def congestion(self) -> None:
+        """Host alive but overloaded: a trial request does not close the circuit, the next trial is after `reset_timeout`"""
+
+        with self._lock:
+            if self.trial:
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+    def cancel(self) -> None:
+        """Request ended without an answer about the host (eg. a bug in the caller): let another trial through"""
+
+        with self._lock:
+            self.trial = False
+
+
+
+
+class HostPolicy:
+
+    """Rate, concurrency and circuit state of a single host"""
+
+    def __init__(self, host:str, policy:'RatePolicy') -> None:
+        self.host = host
+        self.policy = policy
+        self.bucket = TokenBucket(policy.rate, policy.burst, policy.min_rate, policy.max_rate)
+        self.limiter = AdaptiveLimiter(policy.concurrency, policy.min_concurrency, policy.max_concurrency)
+        self.breaker = CircuitBreaker(policy.failure_threshold, policy.reset_timeout)
+
+    def acquire(self) -> None:
+        """Wait for a request slot, to `release` once the request ends. Raise `CircuitOpenError` if the host is considered down."""
+
+        if not self.breaker.allow():
+            raise CircuitOpenError(f'Circuit open for {self.host}, too many failed requests')
+        self.bucket.acquire()
+        self.limiter.acquire()
+
+    def release(self) -> None:
+        """Give back the request slot, whatever the outcome of the request (the rate signals are reported apart)"""
+
+        self.limiter.release()
+
+    def success(self, latency:float) -> None:
+        self.breaker.success()
+        if latency > self.policy.latency_target:
+            # Slow answers are an early congestion signal
+            self.limiter.decrease(self.policy.slow_decrease)
+        else:
+            self.limiter.increase()
+            self.bucket.increase(self.policy.rate_step)
+
+    def congestion(self) -> None:
+        """Server asked to slow down (429 / 503), the host is alive"""
+
+        self.limiter.decrease(self.policy.decrease)
+        self.bucket.decrease(self.policy.decrease)
+        self.breaker.congestion()
+
+    def failure(self) -> None:
+        """Server error or network failure"""
+
+        self.limiter.decrease(self.policy.decrease)
+        self.bucket.decrease(self.policy.decrease)
+        self.breaker.failure()
+
+    def done(self) -> None:
+        """Request answered without any rate signal (eg. 404)"""
+
+        self.breaker.success()
+
+    def cancel(self) -> None:
+        """Request interrupted by an unexpected error, neither a success nor a host failure"""
+
+        self.breaker.cancel()
+
+
+
+
+class RatePolicy:
+
+    """Shared request policy: per-host token bucket, adaptive concurrency, exponential backoff and circuit breaker"""
+
+    def __init__(
+            self,
+            rate:float=5, burst:int=10, min_rate:float=.5, max_rate:float=20, rate_step:float=.1,
+            concurrency:int=4, min_concurrency:int=1, max_concurrency:int=16,
+            decrease:float=.5, slow_decrease:float=.9, latency_target:float=2.,
+            retries:int=4, backoff:float=.5, max_backoff:float=30.,
+            failure_threshold:int=5, reset_timeout:float=30.
+        ) -> None:
+        """Create a request policy
+
+        Args:
+            rate (float): Initial requests per second allowed per host. Defaults to 5
+            burst (int): Token bucket size. Defaults to 10
+            min_rate (float), max_rate (float): Bounds of the adaptive rate
+            rate_step (float): Rate added on each fast success. Defaults to 0.1
+            concurrency (int): Initial concurrent requests per host. Defaults to 4
+            min_concurrency (int), max_concurrency (int): Bounds of the adaptive concurrency
+            decrease (float): Multiplicative decrease on 429 / 5xx. Defaults to 0.5
+            slow_decrease (float): Multiplicative decrease when latency exceeds `latency_target`. Defaults to 0.9
+            latency_target (float): Latency (seconds) above which a response is considered slow. Defaults to 2
+            retries (int): Max retries on transient failures. Defaults to 4
+            backoff (float): Base backoff delay (seconds). Defaults to 0.5
+            max_backoff (float): Max backoff delay (seconds). Defaults to 30
+            failure_threshold (int): Consecutive failures opening the circuit. Defaults to 5
+            reset_timeout (float): Seconds before a trial request on an open circuit. Defaults to 30
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate_step = rate_step
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.decrease = decrease
+        self.slow_decrease = slow_decrease
+        self.latency_target = latency_target
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, url:str) -> HostPolicy:
+        """Get (or create) the state of the host of `url`"""
+
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = HostPolicy(host, self)
+            return self._hosts[host]
+
+    def delay(self, attempt:int, retry_after:str=None) -> float:
+        """Exponential backoff with full jitter, `Retry-After` header wins when provided
+
+        Args:
+            attempt (int): The retry number (starting at 0)
+            retry_after (str, optional): The `Retry-After` response header
+
+        Returns:
+            float: Seconds to wait before retrying
+        """
+
+        if retry_after:
+            wait = self._parse_retry_after(retry_after)
+            if wait is not None:
+                return min(wait, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def _parse_retry_after(value:str) -> float|None:
+        if value.strip().isdigit():
+            return float(value)
+        try:
+            retry_date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_date.tzinfo is None:
+            retry_date = retry_date.replace(tzinfo=timezone.utc)
+        return max(0., (retry_date - datetime.now(timezone.utc)).total_seconds())
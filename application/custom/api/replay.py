@@ -0,0 +1,133 @@
+from typing import Any
+import threading
+import random
+import json
+import time
+import os
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .cache import ResponseCache
+
+
+
+
+class ReplayResponse:
+
+    """Minimal `requests.Response` stand-in built from a recorded fixture"""
+
+    def __init__(self, status_code:int, body:str='', headers:dict=None, url:str=None) -> None:
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.content = body.encode()
+        self.text = body
+        self.url = url
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} Error for url: {self.url}', response=self)
+
+
+
+
+class RecordingSession:
+
+    """Session wrapper saving every answered request as a JSON fixture, to be served later by `ReplaySession`"""
+
+    def __init__(self, session, fixtures_path:str) -> None:
+        """Wrap a live session
+
+        Args:
+            session (requests.Session | curl_cffi.requests.Session): The session doing the real requests
+            fixtures_path (str): Directory where fixtures are written
+        """
+
+        self.session = session
+        self.fixtures_path = fixtures_path
+        os.makedirs(fixtures_path, exist_ok=True)
+
+    @property
+    def headers(self):
+        return self.session.headers
+
+    @headers.setter
+    def headers(self, value):
+        self.session.headers = value
+
+    def request(self, method:str, url:str, **kwargs):
+        response = self.session.request(method, url, **kwargs)
+        key = ResponseCache.make_key(method, url, kwargs.get('params'), kwargs.get('json'))
+        fixture = {
+            'method': method.upper(),
+            'url': url,
+            'params': kwargs.get('params'),
+            'json': kwargs.get('json'),
+            'status': response.status_code,
+            'headers': {k: v for k, v in response.headers.items() if k.lower() in ('content-type', 'etag', 'last-modified')},
+            'body': response.text
+        }
+        with open(os.path.join(self.fixtures_path, key + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(fixture, f, ensure_ascii=False, default=str)
+        return response
+
+
+
+
+class ReplaySession:
+
+    """Offline session serving recorded fixtures, with configurable latency and error injection"""
+
+    def __init__(self, fixtures_path:str, latency:float=0., jitter:float=0., error_rate:float=0., error_status:int=503, seed:int=None) -> None:
+        """Load the fixtures of a directory
+
+        Args:
+            fixtures_path (str): Directory written by `RecordingSession`
+            latency (float): Seconds added to each request. Defaults to 0
+            jitter (float): Random seconds (uniform, up to `jitter`) added on top of `latency`. Defaults to 0
+            error_rate (float): Fraction of requests answered with `error_status`. Defaults to 0
+            error_status (int): Status code of injected errors. Defaults to 503
+            seed (int, optional): Random seed, for reproducible error injection
+        """
+
+        self.headers = {}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.fixtures = self.__load(fixtures_path)
+
+    @staticmethod
+    def __load(fixtures_path:str) -> dict[str, dict]:
+        fixtures = {}
+        for name in os.listdir(fixtures_path):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(fixtures_path, name), 'r', encoding='utf-8') as f:
+                fixtures[name[:-5]] = json.load(f)
+        return fixtures
+
+    def request(self, method:str, url:str, **kwargs) -> ReplayResponse:
+        with self._lock:
+            self.calls += 1
+            wait = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.error_rate
+        if wait:
+            time.sleep(wait)
+        if failed:
+            return ReplayResponse(self.error_status, headers={'Retry-After': '0'}, url=url)
+
+        key = ResponseCache.make_key(method, url, kwargs.get('params'), kwargs.get('json'))
+        fixture = self.fixtures.get(key)
+        if fixture is None:
+            with self._lock:
+                self.misses += 1
+            return ReplayResponse(404, url=url)
+        return ReplayResponse(fixture['status'], fixture['body'], fixture['headers'], url=url)
@@ -1,2 +1,3 @@
 from .offer.offer_db import OfferDB
-from .user.user_db import UserDB
\ No newline at end of file
+from .user.user_db import UserDB
+from .pool import ConnectionPool
\ No newline at end of file
@@ -0,0 +1,60 @@
+from dataclasses import dataclass, field
+from typing import Callable
+import sqlite3
+
+
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    statements: list[str] = field(default_factory=list) # run in order, after `apply`
+    apply: Callable[[sqlite3.Connection], None] = None  # for steps depending on the current data or schema
+
+
+
+
+def migrate(conn:sqlite3.Connection, migrations:list[Migration]) -> list[int]:
+    """Apply the pending migrations in version order, each in its own write transaction.
+
+    Applied versions are recorded in a `schema_version` table. The write lock is taken before reading the current
+    version, so processes starting at the same time apply each migration once.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database (not in a transaction)
+        migrations (list[Migration]): Every migration of the database
+
+    Returns:
+        list[int]: The versions applied by this call
+    """
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version    INTEGER PRIMARY KEY,
+            name       TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+    applied = []
+    for migration in sorted(migrations, key=lambda m: m.version):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+            if migration.version <= current:
+                conn.rollback()
+                continue
+            if migration.apply:
+                migration.apply(conn)
+            for stmt in migration.statements:
+                conn.execute(stmt)
+            conn.execute("INSERT INTO schema_version(version, name) VALUES (?, ?)", [migration.version, migration.name])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f'Applied migration {migration.version} ({migration.name})')
+        applied.append(migration.version)
+    return applied
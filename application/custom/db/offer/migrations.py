@@ -0,0 +1,259 @@
+import sqlite3
+
+from ..migrations import Migration
+from . import stats
+
+
+
+
+def _merge_duplicates(conn:sqlite3.Connection, table:str, id_column:str, key_columns:list[str], references:list[tuple[str, str]]) -> None:
+    # Keep the first row of each natural key and point the references of the others to it
+    keys = ', '.join(key_columns)
+    join = ' AND '.join(f"t.{column} = k.{column}" for column in key_columns)
+    conn.execute("DROP TABLE IF EXISTS temp._merge")
+    conn.execute(f"""
+        CREATE TEMP TABLE _merge AS
+        SELECT t.{id_column} AS old_id, k.keep_id AS new_id
+        FROM {table} t
+        JOIN (
+            SELECT {keys}, MIN({id_column}) AS keep_id FROM {table}
+            GROUP BY {keys} HAVING COUNT(*) > 1
+        ) k ON {join}
+        WHERE t.{id_column} <> k.keep_id
+    """)
+    for ref_table, ref_column in references:
+        # OR IGNORE: link rows already pointing to the kept row stay as they are, and are deleted below
+        conn.execute(f"""
+            UPDATE OR IGNORE {ref_table}
+            SET {ref_column} = (SELECT new_id FROM _merge WHERE old_id = {ref_table}.{ref_column})
+            WHERE {ref_column} IN (SELECT old_id FROM _merge)
+        """)
+        conn.execute(f"DELETE FROM {ref_table} WHERE {ref_column} IN (SELECT old_id FROM _merge)")
+    conn.execute(f"DELETE FROM {table} WHERE {id_column} IN (SELECT old_id FROM _merge)")
+    conn.execute("DROP TABLE _merge")
+
+
+def _prepare_indexes(conn:sqlite3.Connection) -> None:
+    # Databases created before external ids and crawl checkpoints
+    columns = {row[1] for row in conn.execute("PRAGMA table_info('OFFER')")}
+    if 'external_id' not in columns:
+        conn.execute("ALTER TABLE OFFER ADD COLUMN external_id TEXT")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS CHECKPOINT (
+            source        TEXT PRIMARY KEY,
+            stop_date     TEXT,
+            offset        INTEGER NOT NULL DEFAULT 0,
+            last_date     TEXT,
+            last_offer_id INTEGER,
+            updated_at    TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Unique indexes cannot be created over duplicates
+    _merge_duplicates(conn, 'REGION', 'region_id', ['code'], [('CITY', 'region_id')])
+    _merge_duplicates(conn, 'CITY', 'city_id', ['name', 'region_id'], [('OFFER', 'city_id')])
+    _merge_duplicates(conn, 'COMPANY', 'company_id', ['name'], [('OFFER', 'company_id')])
+    _merge_duplicates(conn, 'SKILL', 'skill_id', ['skill'], [('OFFER_SKILL', 'skill_id')])
+    _merge_duplicates(conn, 'DEGREE', 'degree_id', ['degree'], [('OFFER_DEGREE', 'degree_id')])
+
+    # Offers stored twice under the same external id: keep the first one
+    conn.execute("DROP TABLE IF EXISTS temp._duplicate")
+    conn.execute("""
+        CREATE TEMP TABLE _duplicate AS
+        SELECT o.offer_id, o.description_id, o.tfidf_id FROM OFFER o
+        WHERE o.external_id IS NOT NULL AND o.offer_id > (
+            SELECT MIN(offer_id) FROM OFFER WHERE source = o.source AND external_id = o.external_id
+        )
+    """)
+    conn.execute("DELETE FROM OFFER_SKILL WHERE offer_id IN (SELECT offer_id FROM _duplicate)")
+    conn.execute("DELETE FROM OFFER_DEGREE WHERE offer_id IN (SELECT offer_id FROM _duplicate)")
+    conn.execute("DELETE FROM TFIDF WHERE rowid IN (SELECT tfidf_id FROM _duplicate WHERE tfidf_id IS NOT NULL)")
+    conn.execute("DELETE FROM DESCRIPTION WHERE description_id IN (SELECT description_id FROM _duplicate)")
+    conn.execute("DELETE FROM OFFER WHERE offer_id IN (SELECT offer_id FROM _duplicate)")
+    conn.execute("DROP TABLE _duplicate")
+
+
+def _cosine_tfidf(conn:sqlite3.Connection) -> None:
+    # The distance metric of a vec0 column is fixed at creation: the table is rebuilt, keeping the rowids
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'TFIDF'").fetchone()[0]
+    if 'distance_metric=cosine' in sql:
+        return # created by an up-to-date `create_offer_bd.py`
+    # (renaming a vec0 table keeps the names of its shadow tables, the rows go through a temporary table instead)
+    conn.execute("DROP TABLE IF EXISTS temp._tfidf")
+    conn.execute("CREATE TEMP TABLE _tfidf AS SELECT rowid AS tfidf_id, emb_50d, emb_3d FROM TFIDF")
+    conn.execute("DROP TABLE TFIDF")
+    conn.execute("""
+        CREATE VIRTUAL TABLE TFIDF
+        USING vec0(
+            emb_50d  FLOAT[50] distance_metric=cosine,
+            emb_3d   FLOAT[3]
+        )
+    """)
+    conn.execute("INSERT INTO TFIDF(rowid, emb_50d, emb_3d) SELECT tfidf_id, emb_50d, emb_3d FROM _tfidf")
+    conn.execute("DROP TABLE _tfidf")
+
+
+def _filtered_tfidf(conn:sqlite3.Connection) -> None:
+    # Offer fields filtered by the KNN search, stored in the vec0 table (rebuilt, keeping the rowids and embeddings)
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'TFIDF'").fetchone()[0]
+    if 'partition key' in sql.lower():
+        return # created by an up-to-date `create_offer_bd.py`
+    conn.execute("DROP TABLE IF EXISTS temp._tfidf")
+    conn.execute("CREATE TEMP TABLE _tfidf AS SELECT rowid AS tfidf_id, emb_50d, emb_3d FROM TFIDF")
+    conn.execute("DROP TABLE TFIDF")
+    conn.execute("""
+        CREATE VIRTUAL TABLE TFIDF
+        USING vec0(
+            source         TEXT PARTITION KEY,
+            emb_50d        FLOAT[50] distance_metric=cosine,
+            emb_3d         FLOAT[3],
+            salary_min     FLOAT,
+            city_id        INTEGER,
+            region_id      INTEGER,
+            company_id     INTEGER,
+            cluster_id     INTEGER,
+            contract_type  TEXT,
+            date           TEXT
+        )
+    """)
+    # Embeddings without offer get placeholder values (vec0 columns cannot be NULL)
+    conn.execute("""
+        INSERT INTO TFIDF(rowid, emb_50d, emb_3d, source, salary_min, city_id, region_id, company_id, cluster_id, contract_type, date)
+        SELECT
+            t.tfidf_id, t.emb_50d, t.emb_3d,
+            COALESCE(o.source, ''),
+            CAST(COALESCE(o.salary_min, 0) AS REAL),
+            COALESCE(o.city_id, -1),
+            COALESCE(ci.region_id, -1),
+            COALESCE(o.company_id, -1),
+            COALESCE(o.cluster_id, -1),
+            COALESCE(o.contract_type, ''),
+            COALESCE(o.date, '')
+        FROM _tfidf t
+        LEFT JOIN OFFER o ON o.tfidf_id = t.tfidf_id
+        LEFT JOIN CITY ci ON ci.city_id = o.city_id
+    """)
+    conn.execute("DROP TABLE _tfidf")
+
+
+def _fill_stats(conn:sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE SOURCE_STATS (
+            source      TEXT PRIMARY KEY,
+            total       INTEGER NOT NULL,
+            latest_date TEXT,
+            null_counts TEXT NOT NULL, -- JSON: column -> count
+            updated_at  TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur = conn.cursor()
+    stats.save(cur, stats.scan(cur))
+
+
+
+
+MIGRATIONS = [
+    Migration(
+        version=1,
+        name='lookup indexes and natural key constraints',
+        apply=_prepare_indexes,
+        statements=[
+            # Natural keys, used by `INSERT ... ON CONFLICT` (NULL keys are not constrained)
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_region_code ON REGION(code)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_city_name_region ON CITY(name, region_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_company_name ON COMPANY(name)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_skill ON SKILL(skill)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_degree ON DEGREE(degree)",
+            "DROP INDEX IF EXISTS idx_offer_external_id",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_offer_external_id ON OFFER(source, external_id)",
+            # Lookups of the ingestion and listing paths
+            "CREATE INDEX IF NOT EXISTS idx_city_region ON CITY(region_id)",
+            "CREATE INDEX IF NOT EXISTS idx_offer_title_company_date ON OFFER(title, company_id, date)",
+            "CREATE INDEX IF NOT EXISTS idx_offer_source_date ON OFFER(source, date)",
+            "CREATE INDEX IF NOT EXISTS idx_offer_cluster ON OFFER(cluster_id)",
+            "ANALYZE"
+        ]
+    ),
+    Migration(
+        version=2,
+        name='per-source stats, updated on ingest',
+        apply=_fill_stats
+    ),
+    Migration(
+        version=3,
+        name='offer keyset pagination index',
+        statements=[
+            # `iter_offers` pages on (date, offer_id), the rowid is part of the index
+            "CREATE INDEX IF NOT EXISTS idx_offer_date ON OFFER(date)"
+        ]
+    ),
+    Migration(
+        version=4,
+        name='cosine distance on the 50d embeddings (vec0 KNN)',
+        apply=_cosine_tfidf,
+        statements=[
+            # KNN results are joined to their offers
+            "CREATE INDEX IF NOT EXISTS idx_offer_tfidf ON OFFER(tfidf_id)"
+        ]
+    ),
+    Migration(
+        version=5,
+        name='search filter columns on the embeddings (vec0 metadata)',
+        apply=_filtered_tfidf
+    ),
+    Migration(
+        version=6,
+        name='full-text index of the offers (FTS5), kept in sync by triggers',
+        statements=[
+            # rowid = offer_id
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS OFFER_FTS
+            USING fts5(title, offer_description, profile_description, tokenize = 'unicode61 remove_diacritics 2')
+            """,
+            """
+            INSERT INTO OFFER_FTS(rowid, title, offer_description, profile_description)
+            SELECT o.offer_id, o.title, d.offer_description, d.profile_description
+            FROM OFFER o
+            JOIN DESCRIPTION d ON d.description_id = o.description_id
+            """,
+            # Descriptions are inserted before their offers
+            """
+            CREATE TRIGGER IF NOT EXISTS offer_fts_insert AFTER INSERT ON OFFER BEGIN
+                INSERT INTO OFFER_FTS(rowid, title, offer_description, profile_description)
+                SELECT new.offer_id, new.title, d.offer_description, d.profile_description
+                FROM DESCRIPTION d WHERE d.description_id = new.description_id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS offer_fts_update AFTER UPDATE OF title, description_id ON OFFER BEGIN
+                DELETE FROM OFFER_FTS WHERE rowid = old.offer_id;
+                INSERT INTO OFFER_FTS(rowid, title, offer_description, profile_description)
+                SELECT new.offer_id, new.title, d.offer_description, d.profile_description
+                FROM DESCRIPTION d WHERE d.description_id = new.description_id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS offer_fts_delete AFTER DELETE ON OFFER BEGIN
+                DELETE FROM OFFER_FTS WHERE rowid = old.offer_id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS description_fts_update AFTER UPDATE OF offer_description, profile_description ON DESCRIPTION BEGIN
+                UPDATE OFFER_FTS
+                SET offer_description = new.offer_description, profile_description = new.profile_description
+                WHERE rowid IN (SELECT offer_id FROM OFFER WHERE description_id = new.description_id);
+            END
+            """
+        ]
+    ),
+    Migration(
+        version=7,
+        name='keyset pagination over NULL dates',
+        statements=[
+            # `iter_offers` pages on (COALESCE(date, ''), offer_id): offers without date come last instead of being skipped
+            "DROP INDEX IF EXISTS idx_offer_date",
+            "CREATE INDEX IF NOT EXISTS idx_offer_date_key ON OFFER(COALESCE(date, ''))",
+            "CREATE INDEX IF NOT EXISTS idx_offer_source_date_key ON OFFER(source, COALESCE(date, ''))"
+        ]
+    ),
+]
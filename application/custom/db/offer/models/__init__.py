@@ -1 +1 @@
-from .offer import Offer, Description, City, Region, Company, Cluster
\ No newline at end of file
+from .offer import Offer, Description, City, Region, Company, Cluster, Checkpoint
\ No newline at end of file
@@ -33,6 +33,14 @@ class Cluster:
     main_tokens: str = None
     name: str = None
 
+@dataclass
+class Checkpoint:
+    source: str
+    stop_date: Optional[str] = None   # lower bound (ISO date) of the interrupted crawl
+    offset: int = 0                   # index of the first result of the search page being ingested
+    last_date: Optional[str] = None   # date of the last committed offer
+    last_offer_id: Optional[int] = None
+
 @dataclass
 class Offer:
     title: str
@@ -53,6 +61,7 @@ class Offer:
     cluster: Optional[Cluster] = None
     degrees: List[str] = field(default_factory=list)  # degree names
     skills: List[str] = field(default_factory=list)   # skill names
+    external_id: Optional[str] = None                 # offer id on the source side
 
     dict = asdict
 
@@ -2,10 +2,18 @@ import sqlite3
 import sqlite_vec
 
 from datetime import date
+from functools import partial
+from typing import ContextManager, Generator
 import os
+import re
+import json
 import numpy as np
 
-from .models import Offer, Description, City, Region, Company, Cluster
+from .models import Offer, Description, City, Region, Company, Cluster, Checkpoint
+from .migrations import MIGRATIONS
+from . import stats
+from ..migrations import migrate
+from ..pool import ConnectionPool
 
 
 
@@ -13,152 +21,221 @@ from .models import Offer, Description, City, Region, Company, Cluster
 class OfferDB:
 
     path = 'db/offer.db'
+    chunk_size = 500 # bound values per `IN (...)` lookup
+    pool_size = 8 # connections kept open, sqlite-vec loaded once per connection
+    read_pool_size = 8 # `query_only` connections of the search and listing paths
+    profile = {
+        'journal_mode': 'WAL',      # readers are not blocked by the ingestion writes
+        'synchronous': 'NORMAL',    # safe with WAL, fsync at checkpoints only
+        'cache_size': -64000,       # page cache per connection (negative: KiB)
+        'mmap_size': 268435456,     # bytes of the file read through memory mapping
+        'temp_store': 'MEMORY',     # sorts and temporary indexes
+        'busy_timeout': 10000       # ms to wait on a locked database
+    }
+    page_size = 500 # offers per page of `iter_offers`
+    knn_k = 50 # nearest offers ranked by `search_offer`
+    max_k = 4096 # vec0 KNN limit
+    rrf_k = 60 # reciprocal rank fusion constant of the hybrid search
+    tfidf_metadata = { # TFIDF columns filtered by the KNN search, copied from the offer (vec0 has no NULL: unknown is 0, -1 or '')
+        'source': "o.source",
+        'salary_min': "CAST(COALESCE(o.salary_min, 0) AS REAL)",
+        'city_id': "o.city_id",
+        'region_id': "ci.region_id",
+        'company_id': "o.company_id",
+        'cluster_id': "COALESCE(o.cluster_id, -1)",
+        'contract_type': "COALESCE(o.contract_type, '')",
+        'date': "COALESCE(o.date, '')"
+    }
+    filter_lookups = { # search filters given by ID or name
+        'company': "SELECT company_id FROM COMPANY WHERE company_id = :value OR name = :value COLLATE NOCASE",
+        'city': "SELECT city_id FROM CITY WHERE city_id = :value OR name = :value COLLATE NOCASE",
+        'region': "SELECT region_id FROM REGION WHERE region_id = :value OR code = :value OR name = :value COLLATE NOCASE"
+    }
+    offer_columns = {
+        'offer_id': 'o.offer_id',
+        'title': 'o.title',
+        'job_name': 'o.job_name',
+        'job_type': 'o.job_type',
+        'contract_type': 'o.contract_type',
+        'salary_label': 'o.salary_label',
+        'salary_min': 'o.salary_min',
+        'salary_max': 'o.salary_max',
+        'min_experience': 'o.min_experience',
+        'latitude': 'o.latitude',
+        'longitude': 'o.longitude',
+        'date': 'o.date',
+        'source': 'o.source',
+        'external_id': 'o.external_id',
+        'cluster_id': 'o.cluster_id',
+        'company_name': 'c.name',
+        'company_description': 'c.description',
+        'company_industry': 'c.industry',
+        'logo_url': 'c.logo_url',
+        'city_name': 'ci.name',
+        'region_code': 'r.code',
+        'region_name': 'r.name',
+        'offer_description': 'd.offer_description',
+        'profile_description': 'd.profile_description'
+    }
+    offer_joins = { # only the joins of the selected columns are done
+        'c': "JOIN COMPANY c ON c.company_id = o.company_id",
+        'd': "JOIN DESCRIPTION d ON d.description_id = o.description_id",
+        'ci': "JOIN CITY ci ON ci.city_id = o.city_id",
+        'r': "JOIN REGION r ON r.region_id = ci.region_id"
+    }
+
+    def __init__(self, profile:dict=None) -> None:
+        """Open the offer database
+
+        Args:
+            profile (dict, optional): Pragmas overriding the default `profile` (eg. `{'cache_size': -256000}`)
+        """
 
-    def __init__(self) -> None:
         root = os.environ.get('DATA_PATH', 'data/')
         self.db_path = os.path.join(root, self.path)
+        self.profile = {**self.profile, **(profile or {})}
+        self.pool = ConnectionPool(self._create_connection, max_size=self.pool_size)
+        self.read_pool = ConnectionPool(partial(self._create_connection, read_only=True), max_size=self.read_pool_size)
+        self.migrate()
+
+    def migrate(self) -> list[int]:
+        """Apply the pending schema migrations (see `migrations.py`). Run at startup, and after `create_schema` on a new database.
+
+        Returns:
+            list[int]: The versions applied
+        """
+
+        with self.connect() as conn:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'OFFER'").fetchone():
+                return [] # schema not created yet (`_process/create_offer_bd.py`)
+            return migrate(conn, MIGRATIONS)
 
     @staticmethod
     def _vecf32_converter(blob:bytes) -> np.ndarray:
         # copy() so the array owns the memory even after SQLite frees the buffer
         return np.frombuffer(blob, dtype=np.float32).copy()
 
-    def _get_or_create_region(self, cur:sqlite3.Cursor, region:Region) -> int:
-        row = cur.execute(
-            "SELECT region_id FROM REGION WHERE code = ?", [region.code]
-        ).fetchone()
-        if row:
-            return row[0]
-
-        cur.execute(
-            "INSERT INTO REGION(code, name) VALUES (?, ?)", [region.code, region.name]
+    def _select_chunks(self, cur:sqlite3.Cursor, sql:str, values:list, params:list=None) -> list[tuple]:
+        # Run `sql` (with an `IN ({})` placeholder) on chunks of values
+        rows = []
+        for i in range(0, len(values), self.chunk_size):
+            chunk = values[i:i + self.chunk_size]
+            rows.extend(cur.execute(sql.format(','.join('?' * len(chunk))), [*(params or []), *chunk]))
+        return rows
+
+    def _insert_many(self, cur:sqlite3.Cursor, table:str, id_column:str, columns:tuple[str], rows:list[tuple]) -> list[int]:
+        # Insert rows with consecutive explicit ids (the transaction holds the write lock) and return them
+        if not rows:
+            return []
+        start = cur.execute(f"SELECT COALESCE(MAX({id_column}), 0) + 1 FROM {table}").fetchone()[0]
+        ids = list(range(start, start + len(rows)))
+        cur.executemany(
+            f"INSERT INTO {table}({id_column}, {', '.join(columns)}) VALUES ({', '.join('?' * (len(columns) + 1))})",
+            [(id, *row) for id, row in zip(ids, rows)]
         )
-        return cur.lastrowid
-    
-    def _get_or_create_city(self, cur:sqlite3.Cursor, city:City, region_id:int) -> int:
-        row = cur.execute(
-            "SELECT city_id FROM CITY WHERE name = ? AND region_id = ?", [city.name, region_id]
-        ).fetchone()
-        if row:
-            return row[0]
+        return ids
 
-        cur.execute(
-            "INSERT INTO CITY(name, region_id) VALUES (?, ?)", [city.name, region_id]
-        )
-        return cur.lastrowid
-    
-    def _get_or_create_company(self, cur:sqlite3.Cursor, company:Company) -> int:
-        row = cur.execute(
-            "SELECT company_id FROM COMPANY WHERE name = ?", [company.name]
-        ).fetchone()
-        if row:
-            return row[0]
-        
-        cur.execute(
-            "INSERT INTO COMPANY(name, description, industry, logo_url) VALUES (?, ?, ?, ?)",
-            [company.name, company.description, company.industry, company.logo_url]
-        )
-        return cur.lastrowid
-    
-    def _insert_description(self, cur:sqlite3.Cursor, description:Description) -> int:
-        cur.execute(
-            "INSERT INTO DESCRIPTION(offer_description, profile_description) VALUES (?, ?)",
-            [description.offer_description, description.profile_description]
-        )
-        return cur.lastrowid
-    
-    def _insert_offer(self, cur:sqlite3.Cursor, offer:Offer, company_id:int, city_id:int, description_id:int) -> int:
-        # Try to fetch the existing ID (skip duplicates)
-        existing = cur.execute(
-            """
-            SELECT offer_id
-            FROM OFFER
-            WHERE title = ? AND company_id = ? AND date = ?
-            """,
-            [offer.title, company_id, offer.date]
-        ).fetchone()
-        if existing:
-            return existing[0]
+    def _get_or_create_many(self, cur:sqlite3.Cursor, table:str, id_column:str, columns:tuple[str], rows:dict) -> dict:
+        """Map natural keys to ids, creating the missing rows with a single `INSERT ... ON CONFLICT DO NOTHING`
 
-        cur.execute(
-            """
-            INSERT INTO OFFER
-                (title, job_name, job_type, contract_type,
-                 salary_label, salary_min, salary_max, min_experience, latitude, longitude,
-                 date, source,
-                 description_id, city_id, company_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            [
-                offer.title,
-                offer.job_name,
-                offer.job_type,
-                offer.contract_type,
-                offer.salary_label,
-                offer.salary_min,
-                offer.salary_max,
-                offer.min_experience,
-                offer.latitude,
-                offer.longitude,
-                offer.date,
-                offer.source,
-                description_id,
-                city_id,
-                company_id
-            ]
-        )
-        return cur.lastrowid
-    
-    def _sync_degrees(self, cur:sqlite3.Cursor, offer_id:int, degrees:list[str]) -> None:
-        for degree in degrees:
-            degree_id = self._get_or_create_degree(cur, degree)
-            cur.execute(
-                "INSERT OR IGNORE INTO OFFER_DEGREE(offer_id, degree_id) VALUES (?, ?)",
-                [offer_id, degree_id]
-            )
-
-    def _sync_skills(self, cur:sqlite3.Cursor, offer_id:int, skills:list[str]) -> None:
-        for skill in skills:
-            skill_id = self._get_or_create_skill(cur, skill)
-            cur.execute(
-                "INSERT OR IGNORE INTO OFFER_SKILL(offer_id, skill_id) VALUES (?, ?)",
-                [offer_id, skill_id]
-            )
+        Args:
+            cur (sqlite3.Cursor): Cursor of the write transaction
+            table (str): The dimension table (with a unique index on the natural key)
+            id_column (str): Its primary key
+            columns (tuple[str]): Inserted columns, the natural key first
+            rows (dict): Natural key -> row values (in `columns` order)
 
-    def _get_or_create_degree(self, cur:sqlite3.Cursor, degree:str) -> int:
-        row = cur.execute(
-            "SELECT degree_id FROM DEGREE WHERE degree = ?", [degree]
-        ).fetchone()
-        if row:
-            return row[0]
+        Returns:
+            dict: Natural key -> id
+        """
 
-        cur.execute("INSERT INTO DEGREE(degree) VALUES (?)", [degree])
-        return cur.lastrowid
-    
-    def _get_or_create_skill(self, cur:sqlite3.Cursor, skill:str) -> int:
-        row = cur.execute(
-            "SELECT skill_id FROM SKILL WHERE skill = ?", [skill]
-        ).fetchone()
-        if row:
-            return row[0]
-
-        cur.execute("INSERT INTO SKILL(skill) VALUES (?)", [skill])
-        return cur.lastrowid
-
-    def _get_or_create_cluster(self, cur:sqlite3.Cursor, cluster:Cluster) -> int:
-        row = cur.execute(
-            "SELECT cluster_id FROM CLUSTER WHERE cluster_id = ?", [cluster.id]
-        ).fetchone()
-        if row:
-            return row[0]
-
-        cur.execute("INSERT INTO CLUSTER(cluster_id, cluster_name, main_tokens) VALUES (?, ?, ?)", [cluster.id, cluster.name, cluster.main_tokens])
-        return cluster.id
-
-    def _row_to_offer(self, row:sqlite3.Row) -> Offer:
-        degrees = row["degrees"].split("||") if row["degrees"] else []
-        skills = row["skills"].split("||") if row["skills"] else []
+        key_column = columns[0]
+
+        def lookup() -> dict:
+            ids = dict(self._select_chunks(
+                cur, f"SELECT {key_column}, MIN({id_column}) FROM {table} WHERE {key_column} IN ({{}}) GROUP BY {key_column}",
+                [key for key in rows if key is not None]
+            ))
+            if None in rows:
+                # NULL keys are not unique, the first row is reused
+                row = cur.execute(f"SELECT MIN({id_column}) FROM {table} WHERE {key_column} IS NULL").fetchone()
+                if row[0] is not None:
+                    ids[None] = row[0]
+            return ids
+
+        ids = lookup()
+        missing = [key for key in rows if key not in ids]
+        if missing:
+            cur.executemany(
+                f"INSERT INTO {table}({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) ON CONFLICT DO NOTHING",
+                [rows[key] for key in missing if key is not None] + ([rows[None]] if None in missing else [])
+            )
+            ids = lookup()
+        return ids
+
+    def _get_or_create_cities(self, cur:sqlite3.Cursor, cities:set[tuple[str, int]]) -> dict[tuple[str, int], int]:
+        # (name, region_id) -> city_id, cities are looked up by region
+
+        def lookup() -> dict:
+            return {
+                (name, region_id): city_id
+                for name, region_id, city_id in self._select_chunks(
+                    cur, "SELECT name, region_id, MIN(city_id) FROM CITY WHERE region_id IN ({}) GROUP BY name, region_id",
+                    list({region_id for _, region_id in cities})
+                )
+            }
+
+        ids = lookup()
+        missing = [city for city in cities if city not in ids]
+        if missing:
+            cur.executemany("INSERT INTO CITY(name, region_id) VALUES (?, ?) ON CONFLICT DO NOTHING", missing)
+            ids = lookup()
+        return ids
+
+    def _existing_offers(self, cur:sqlite3.Cursor, offers:list[Offer], company_ids:list[int]) -> list[int|None]:
+        # ID of the stored offer of each offer (same source and external id, or same title, company and date)
+        by_external = {}
+        for source in {offer.source for offer in offers}:
+            external_ids = list({offer.external_id for offer in offers if offer.source == source and offer.external_id})
+            for external_id, offer_id in self._select_chunks(
+                cur, "SELECT external_id, offer_id FROM OFFER WHERE source = ? AND external_id IN ({})", external_ids, params=[source]
+            ):
+                by_external[(source, external_id)] = offer_id
+
+        # Looked up by title (`idx_offer_title_company_date`)
+        by_natural = {}
+        natural_keys = {(offer.title, company_id, offer.date) for offer, company_id in zip(offers, company_ids)}
+        for title, company_id, offer_date, offer_id in self._select_chunks(
+            cur, "SELECT title, company_id, date, offer_id FROM OFFER WHERE title IN ({})", list({key[0] for key in natural_keys})
+        ):
+            if (title, company_id, offer_date) in natural_keys:
+                by_natural.setdefault((title, company_id, offer_date), offer_id)
+
+        return [
+            by_external.get((offer.source, offer.external_id)) or by_natural.get((offer.title, company_id, offer.date))
+            for offer, company_id in zip(offers, company_ids)
+        ]
+
+    def _offer_relations(self, cur:sqlite3.Cursor, offer_ids:list[int], names:tuple[str]=('degrees', 'skills')) -> tuple[dict[int, list[str]], ...]:
+        # Degrees and skills of a page of offers, aggregated with one grouped query per link table
+        relations = []
+        for name, link, table, column in (('degrees', 'OFFER_DEGREE', 'DEGREE', 'degree'), ('skills', 'OFFER_SKILL', 'SKILL', 'skill')):
+            if name not in names:
+                relations.append({})
+                continue
+            rows = self._select_chunks(
+                cur,
+                f"""
+                SELECT l.offer_id, GROUP_CONCAT(t.{column}, char(31)) FROM {link} l
+                JOIN {table} t ON t.{column}_id = l.{column}_id
+                WHERE l.offer_id IN ({{}}) GROUP BY l.offer_id
+                """,
+                offer_ids
+            )
+            relations.append({offer_id: values.split('\x1f') for offer_id, values in rows})
+        return tuple(relations)
 
+    def _row_to_offer(self, row:sqlite3.Row|dict, degrees:list[str]=None, skills:list[str]=None) -> Offer:
         return Offer(
             title=row["title"],
             job_name=row["job_name"],
@@ -189,8 +266,8 @@ class OfferDB:
                     name=row["region_name"],
                 ),
             ),
-            degrees=degrees,
-            skills=skills,
+            degrees=degrees or [],
+            skills=skills or [],
         )
     
     def _row_to_cluster(self, row:sqlite3.Row) -> Cluster:
@@ -200,100 +277,317 @@ class OfferDB:
             main_tokens=row['main_tokens']
         )
 
-    def connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+    def _create_connection(self, read_only:bool=False) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
         conn.enable_load_extension(True)
-        sqlite_vec.load(conn) 
+        sqlite_vec.load(conn)
+        conn.enable_load_extension(False)
+        for pragma, value in self.profile.items():
+            conn.execute(f"PRAGMA {pragma} = {value}").fetchall()
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
         return conn
+
+    def connect(self, read_only:bool=False) -> ContextManager[sqlite3.Connection]:
+        """Borrow a pooled connection, to use as `with offer_db.connect() as conn:` (commits at the end of the block)
+
+        Args:
+            read_only (bool): Use a `query_only` connection (search and listing paths). Defaults to False
+        """
+
+        if read_only:
+            return self.read_pool.connection()
+        return self.pool.connection()
+
+    def get_profile(self) -> dict:
+        """Pragmas in effect on the read and write connections"""
+
+        profile = {}
+        for name, read_only in (('write', False), ('read', True)):
+            with self.connect(read_only=read_only) as conn:
+                profile[name] = {
+                    pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+                    for pragma in (*self.profile, 'query_only')
+                }
+        return profile
     
+    def get_stats(self, source:str=None) -> dict:
+        """Offer count, latest date and column summary of a source, read from the stats kept up to date on ingest
+
+        Args:
+            source (str, optional): The source ('NTNE', 'APEC'), all sources if None. Default to None
+
+        Returns:
+            dict: `{total, date, summary}` (see `summary`)
+        """
+
+        with self.connect(read_only=True) as conn:
+            cur = conn.cursor()
+            columns = cur.execute("PRAGMA table_info('OFFER')").fetchall()
+            merged = None
+            for source_stats in stats.load(cur, source).values():
+                merged = stats.merge(merged, source_stats)
+        merged = merged or {'total': 0, 'date': None, 'na': {}}
+
+        return {
+            'total': merged['total'],
+            'date': merged['date'],
+            'summary': [{
+                'name': name,
+                'na': merged['na'].get(name, 0),
+                'not_null': bool(notnull),
+                'type': type
+            } for _, name, type, notnull, _, _ in columns]
+        }
+
     def summary(self, source:str=None) -> list[dict]:
+        """NULL count of each OFFER column
+
+        Args:
+            source (str, optional): The source ('NTNE', 'APEC'), all sources if None. Default to None
+
+        Returns:
+            list[dict]: `{name, na, not_null, type}` per column
+        """
+
+        return self.get_stats(source)['summary']
+
+    def refresh_stats(self, conn:sqlite3.Connection=None) -> None:
+        """Recompute the stats of every source with a single scan (after updates of existing offers, eg. NLP results)
+
+        Args:
+            conn (sqlite3.Connection, optional): Connection of the current write transaction. Default to None
+        """
+
+        if conn is None:
+            with self.connect() as conn:
+                return self.refresh_stats(conn)
+        cur = conn.cursor()
+        stats.save(cur, stats.scan(cur), replace=True)
+
+    def add(self, offers:list[Offer], checkpoint:Checkpoint=None) -> list[int]:
+        """Insert offers into database, in a single transaction. Dimension rows (region, city, company, degree, skill)
+        are resolved with one lookup per table for the whole batch, and new rows are inserted with `executemany`
+        (`ON CONFLICT DO NOTHING` on their natural key).
+        
+        Args:
+            offers (list[Offer]): List of offers to add to db
+            checkpoint (Checkpoint, optional): Crawl checkpoint saved in the same transaction. Default to None
+
+        Returns:
+            list[int]: The offer IDs (existing ID for duplicates)
+        """
+
+        if not offers:
+            return []
+
         with self.connect() as conn:
+            if not conn.in_transaction:
+                # Take the write lock now, new rows get consecutive ids from the current max
+                conn.execute("BEGIN IMMEDIATE")
             cur = conn.cursor()
-            # Get column metadata (name, declared type, etc.)
-            cur.execute("PRAGMA table_info('OFFER')")
-            columns = cur.fetchall()
-
-            summary = []
-            for _, name, type, notnull, _, _ in columns:
-                # Count NULLs in this column
-                if source:
-                    cur.execute(
-                        f"SELECT COUNT(*) FROM OFFER WHERE source = ? and {name} IS NULL", [source]
-                    )
+
+            # Dimensions: natural key maps loaded once, missing rows created in bulk
+            regions = {offer.city.region.code: (offer.city.region.code, offer.city.region.name) for offer in reversed(offers)}
+            region_ids = self._get_or_create_many(cur, 'REGION', 'region_id', ('code', 'name'), regions)
+            city_keys = [(offer.city.name, region_ids[offer.city.region.code]) for offer in offers]
+            city_ids = self._get_or_create_cities(cur, set(city_keys))
+            companies = {
+                offer.company.name: (offer.company.name, offer.company.description, offer.company.industry, offer.company.logo_url)
+                for offer in reversed(offers)
+            }
+            company_ids = self._get_or_create_many(cur, 'COMPANY', 'company_id', ('name', 'description', 'industry', 'logo_url'), companies)
+            degree_ids = self._get_or_create_many(cur, 'DEGREE', 'degree_id', ('degree',), {d: (d,) for o in offers for d in o.degrees})
+            skill_ids = self._get_or_create_many(cur, 'SKILL', 'skill_id', ('skill',), {s: (s,) for o in offers for s in o.skills})
+
+            # Skip offers already stored, and duplicates within the batch
+            offer_company_ids = [company_ids[offer.company.name] for offer in offers]
+            offer_ids = self._existing_offers(cur, offers, offer_company_ids)
+            batch = {}
+            new = []
+            duplicates = []
+            for i, (offer, company_id) in enumerate(zip(offers, offer_company_ids)):
+                if offer_ids[i] is not None:
+                    continue
+                keys = [(offer.title, company_id, offer.date)]
+                if offer.external_id:
+                    keys.append((offer.source, offer.external_id))
+                first = next((batch[key] for key in keys if key in batch), None)
+                if first is None:
+                    batch.update((key, i) for key in keys)
+                    new.append(i)
                 else:
-                    cur.execute(
-                        "SELECT COUNT(*) FROM OFFER WHERE ? IS NULL", [name]
+                    duplicates.append((i, first))
+
+            # New offers and their descriptions
+            description_ids = self._insert_many(
+                cur, 'DESCRIPTION', 'description_id', ('offer_description', 'profile_description'),
+                [(offers[i].description.offer_description, offers[i].description.profile_description) for i in new]
+            )
+            new_ids = self._insert_many(
+                cur, 'OFFER', 'offer_id',
+                ('title', 'job_name', 'job_type', 'contract_type',
+                 'salary_label', 'salary_min', 'salary_max', 'min_experience', 'latitude', 'longitude',
+                 'date', 'source', 'external_id',
+                 'description_id', 'city_id', 'company_id'),
+                [
+                    (
+                        offers[i].title,
+                        offers[i].job_name,
+                        offers[i].job_type,
+                        offers[i].contract_type,
+                        offers[i].salary_label,
+                        offers[i].salary_min,
+                        offers[i].salary_max,
+                        offers[i].min_experience,
+                        offers[i].latitude,
+                        offers[i].longitude,
+                        offers[i].date,
+                        offers[i].source,
+                        offers[i].external_id,
+                        description_id,
+                        city_ids[city_keys[i]],
+                        offer_company_ids[i]
                     )
-                na_count = cur.fetchone()[0]
-                summary.append({
-                    'name': name,
-                    'na': na_count,
-                    'not_null': bool(notnull),
-                    'type': type
-                })
-
-            return summary
-
-    def add(self, offers:list[Offer]) -> int:
-        """Insert offers into database.
-        
+                    for i, description_id in zip(new, description_ids)
+                ]
+            )
+            for i, offer_id in zip(new, new_ids):
+                offer_ids[i] = offer_id
+            for i, first in duplicates:
+                offer_ids[i] = offer_ids[first]
+
+            # Link tables
+            cur.executemany(
+                "INSERT INTO OFFER_DEGREE(offer_id, degree_id) VALUES (?, ?) ON CONFLICT DO NOTHING",
+                [(offer_id, degree_ids[degree]) for offer, offer_id in zip(offers, offer_ids) for degree in offer.degrees]
+            )
+            cur.executemany(
+                "INSERT INTO OFFER_SKILL(offer_id, skill_id) VALUES (?, ?) ON CONFLICT DO NOTHING",
+                [(offer_id, skill_ids[skill]) for offer, offer_id in zip(offers, offer_ids) for skill in offer.skills]
+            )
+
+            # Stats of the new rows only, added to the stored ones
+            if new_ids:
+                new_stats = stats.scan(cur, offer_ids=(new_ids[0], new_ids[-1]))
+                stored = stats.load(cur)
+                stats.save(cur, {source: stats.merge(stored.get(source), s) for source, s in new_stats.items()})
+
+            if checkpoint:
+                checkpoint.last_date = offers[-1].date
+                checkpoint.last_offer_id = offer_ids[-1]
+                self._save_checkpoint(cur, checkpoint)
+
+        return offer_ids
+
+    def _save_checkpoint(self, cur:sqlite3.Cursor, checkpoint:Checkpoint) -> None:
+        cur.execute(
+            """
+            INSERT INTO CHECKPOINT(source, stop_date, offset, last_date, last_offer_id, updated_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(source) DO UPDATE SET
+                stop_date = excluded.stop_date,
+                offset = excluded.offset,
+                last_date = excluded.last_date,
+                last_offer_id = excluded.last_offer_id,
+                updated_at = excluded.updated_at
+            """,
+            [checkpoint.source, checkpoint.stop_date, checkpoint.offset, checkpoint.last_date, checkpoint.last_offer_id]
+        )
+
+    def get_checkpoint(self, source:str) -> Checkpoint|None:
+        """Get the checkpoint of an interrupted crawl
+
         Args:
-            offers (list[Offer]): List of offers to add to db
+            source (str): The source ('NTNE', 'APEC')
+
+        Returns:
+            Checkpoint|None: The checkpoint, None if the last crawl completed
         """
 
         with self.connect() as conn:
-            cur = conn.cursor()
+            row = conn.execute(
+                "SELECT source, stop_date, offset, last_date, last_offer_id FROM CHECKPOINT WHERE source = ?", [source]
+            ).fetchone()
+        return Checkpoint(*row) if row else None
 
-            for offer in offers:
-                region_id = self._get_or_create_region(cur, offer.city.region)
-                city_id = self._get_or_create_city(cur, offer.city, region_id)
-                company_id = self._get_or_create_company(cur, offer.company)
-                description_id = self._insert_description(cur, offer.description)
-
-                offer_id = self._insert_offer(
-                    cur,
-                    offer,
-                    company_id=company_id,
-                    city_id=city_id,
-                    description_id=description_id,
-                )
+    def clear_checkpoint(self, source:str) -> None:
+        """Delete the checkpoint of a source, once its crawl completed
 
-                self._sync_degrees(cur, offer_id, offer.degrees)
-                self._sync_skills(cur, offer_id, offer.skills)
+        Args:
+            source (str): The source ('NTNE', 'APEC')
+        """
 
-            conn.commit()
+        with self.connect() as conn:
+            conn.execute("DELETE FROM CHECKPOINT WHERE source = ?", [source])
 
-    def add_nlp(self, conn:sqlite3.Connection, offer_id:int, emb_50d:np.ndarray=None, emb_3d:np.ndarray=None, cluster:Cluster=None) -> None:
-        """Add offer's nlp data to db. Skip non provided data.
+    def add_nlp_many(self, conn:sqlite3.Connection, offer_ids:list[int], emb_50d:np.ndarray=None, emb_3d:np.ndarray=None, labels:list[int]=None, clusters:list[Cluster]=None) -> None:
+        """Save the nlp data of many offers with one `executemany` per table, in the transaction of `conn`. Skip non provided data.
 
         Args:
             conn (sqlite3.Connection): Database connection
-            offer_id (int): The ID of the offer
-            emb_50d (np.ndarray, optional): 50 dimenssions embeddings. Default to None
-            emb_3d (np.ndarray, optional): 3 dimenssions embeddings. Default to None
-            cluster (Cluster, optional): The offer cluster object. Default to None
+            offer_ids (list[int]): The IDs of the offers
+            emb_50d (np.ndarray, optional): 50 dimensions embeddings, one row per offer. Default to None
+            emb_3d (np.ndarray, optional): 3 dimensions embeddings, one row per offer. Default to None
+            labels (list[int], optional): Cluster ID of each offer. Default to None
+            clusters (list[Cluster], optional): The clusters of `labels`, created if missing. Default to None
         """
 
         cur = conn.cursor()
-        
-        if cluster:
-            cluster_id = self._get_or_create_cluster(cur, cluster)
-            cur.execute(
-                "UPDATE OFFER SET cluster_id = ? WHERE offer_id = ?", 
-                [cluster_id, offer_id]
+
+        if labels is not None:
+            if clusters:
+                existing = {row[0] for row in self._select_chunks(
+                    cur, "SELECT cluster_id FROM CLUSTER WHERE cluster_id IN ({})", [c.id for c in clusters]
+                )}
+                cur.executemany(
+                    "INSERT INTO CLUSTER(cluster_id, cluster_name, main_tokens) VALUES (?, ?, ?)",
+                    [(c.id, c.name, c.main_tokens) for c in clusters if c.id not in existing]
+                )
+            cur.executemany(
+                "UPDATE OFFER SET cluster_id = ? WHERE offer_id = ?",
+                [(int(label), offer_id) for offer_id, label in zip(offer_ids, labels)]
             )
+            if emb_50d is None:
+                # Cluster filter of the KNN search, on the embeddings already stored
+                tfidf_ids = dict(self._select_chunks(
+                    cur, "SELECT offer_id, tfidf_id FROM OFFER WHERE tfidf_id IS NOT NULL AND offer_id IN ({})", list(offer_ids)
+                ))
+                cur.executemany(
+                    "UPDATE TFIDF SET cluster_id = ? WHERE rowid = ?",
+                    [(int(label), tfidf_ids[offer_id]) for offer_id, label in zip(offer_ids, labels) if offer_id in tfidf_ids]
+                )
 
         if emb_50d is not None and emb_3d is not None:
-            cur.execute(
-                "INSERT INTO TFIDF(emb_50d, emb_3d) VALUES (vec_f32(?), vec_f32(?))", 
-                [emb_50d.tobytes(), emb_3d.tobytes()]
+            # Embeddings previously computed for these offers are replaced
+            for i in range(0, len(offer_ids), self.chunk_size):
+                chunk = list(offer_ids[i:i + self.chunk_size])
+                cur.execute(
+                    f"DELETE FROM TFIDF WHERE rowid IN (SELECT tfidf_id FROM OFFER WHERE offer_id IN ({','.join('?' * len(chunk))}))", chunk
+                )
+            emb_50d = np.asarray(emb_50d, dtype=np.float32)
+            emb_3d = np.asarray(emb_3d, dtype=np.float32)
+            # Consecutive explicit rowids (see `_insert_many`), the filtered columns copied from the offers
+            start = cur.execute("SELECT COALESCE(MAX(rowid), 0) + 1 FROM TFIDF").fetchone()[0]
+            tfidf_ids = list(range(start, start + len(offer_ids)))
+            cur.executemany(
+                f"""
+                INSERT INTO TFIDF(rowid, emb_50d, emb_3d, {', '.join(self.tfidf_metadata)})
+                SELECT ?, vec_f32(?), vec_f32(?), {', '.join(self.tfidf_metadata.values())}
+                FROM OFFER o
+                JOIN CITY ci ON ci.city_id = o.city_id
+                WHERE o.offer_id = ?
+                """,
+                [(tfidf_id, emb50.tobytes(), emb3.tobytes(), offer_id) for tfidf_id, emb50, emb3, offer_id in zip(tfidf_ids, emb_50d, emb_3d, offer_ids)]
             )
-            tfidf_id = cur.lastrowid
-            cur.execute(
-                "UPDATE OFFER SET tfidf_id = ? WHERE offer_id = ?", 
-                [tfidf_id, offer_id]
+            cur.executemany(
+                "UPDATE OFFER SET tfidf_id = ? WHERE offer_id = ?",
+                list(zip(tfidf_ids, offer_ids))
             )
 
+        # cluster_id and tfidf_id NULL counts changed
+        self.refresh_stats(conn)
+
     def update_clusters(self, conn:sqlite3.Connection, cluster:Cluster):
         """Update offer's nlp data on db. Update only provided data, skip Nones.
 
@@ -304,42 +598,167 @@ class OfferDB:
 
         curr = conn.cursor()
 
-    def search_offer(self, query:np.ndarray=None, resume:np.ndarray=None, filters:list[dict]=None) -> tuple[list[Offer], list[int], list[int]]:
-        """Search an offer by query, resume and filters.
+    def _search_filters(self, cur:sqlite3.Cursor, filters:list[dict], columns:dict=None) -> tuple[str, dict]|None:
+        """Translate search filters into SQL constraints, on the TFIDF metadata columns (applied by the KNN search
+        itself) or on the offer columns (see `tfidf_metadata`)
 
         Args:
-            query (ndarray, optional): 50d embeddings of a query. Default to None.
+            cur (sqlite3.Cursor): Database cursor
+            filters (list[dict]): Filters as `{name: value}` ('all' or empty values are ignored): `source`, `salary`
+                (`[min, max]`, as JSON or list, None bounds ignored), `category` (cluster ID), `company`, `city`,
+                `region` (ID or name), `contract` (contract type) and `since` (ISO date)
+            columns (dict, optional): TFIDF column -> SQL expression to filter on. TFIDF columns if None. Default to None
+
+        Returns:
+            tuple[str, dict]|None: SQL constraints (each starting with `AND`) and their parameters, None if a filter matches no offer
+        """
+
+        columns = columns or {}
+        constraints = []
+        params = {}
+
+        def add(column:str, condition:str, value) -> None:
+            name = f'filter_{len(params)}'
+            params[name] = value
+            constraints.append(f"{columns.get(column, column)} {condition.format(f':{name}')}")
+
+        for key, value in (item for f in filters or [] for item in f.items()):
+            if value is None or value in ('', 'all'):
+                continue
+            match key:
+                case 'source':
+                    add('source', "= {}", value)
+                case 'salary':
+                    low, high = json.loads(value) if isinstance(value, str) else value
+                    # Unknown salaries are stored as 0: excluded by a minimum, kept by a maximum
+                    if low is not None and float(low) > 0:
+                        add('salary_min', ">= {}", float(low))
+                    if high is not None:
+                        add('salary_min', "<= {}", float(high))
+                case 'category':
+                    add('cluster_id', "= {}", int(value))
+                case 'contract':
+                    add('contract_type', "= {}", value)
+                case 'since':
+                    add('date', ">= {}", date.fromisoformat(value).isoformat())
+                case 'company' | 'city' | 'region':
+                    ids = [row[0] for row in cur.execute(self.filter_lookups[key], {'value': value})]
+                    if not ids:
+                        return None
+                    add(f'{key}_id', "IN (SELECT value FROM json_each({}))", json.dumps(ids))
+                case _:
+                    raise ValueError(f'Unknown search filter: {key}')
+
+        return ''.join(f' AND {constraint}' for constraint in constraints), params
+
+    @staticmethod
+    def _fts_query(text:str) -> str|None:
+        # Any of the terms (quoted, so user input is not parsed as FTS5 syntax), the whole phrase ranking higher
+        terms = re.findall(r'\w+', text or '')
+        if not terms:
+            return None
+        phrases = [' '.join(terms)] if len(terms) > 1 else []
+        return ' OR '.join(f'"{phrase}"' for phrase in [*phrases, *terms])
+
+    def search_offer(self, query:np.ndarray=None, resume:np.ndarray=None, filters:list[dict]=None, k:int=None, limit:int=None, page:int=0, text:str=None, mode:str='vector') -> tuple[list[Offer], list[int], list[int]]:
+        """Search an offer by query, resume and filters. Candidates matching the filters are found by:
+        - 'vector': the `k` offers nearest to the query embeddings, with a single vec0 KNN search (cosine distance)
+        - 'text': the `k` best BM25 matches of the query text, from the FTS5 index (title and descriptions)
+        - 'hybrid': both, fused by reciprocal rank (`1 / (rrf_k + rank)` summed over the two rankings)
+        then ranked by resume distance if a resume is given.
+
+        Args:
+            query (ndarray, optional): 50d embeddings of a query ('vector' and 'hybrid' modes). Default to None.
             resume (ndarray, optional): 50d embeddings of a resume. Default to None.
-            filters (list[dict], optional): Simple result filters. Default to None.
+            filters (list[dict], optional): Simple result filters (see `_search_filters`). Default to None.
+            k (int, optional): Candidates per ranking (at most `max_k`). Default to `knn_k`
+            limit (int, optional): Offers per page of results. Default to `k`
+            page (int): Page of results (from 0). Default to 0
+            text (str, optional): Query text ('text' and 'hybrid' modes). Default to None
+            mode (str): 'vector', 'text' or 'hybrid'. Default to 'vector'
 
         Returns:
             list[Offer]: Offers
             list[int]: Offer IDs
         """
 
-        with self.connect() as conn:
+        if mode not in ('vector', 'text', 'hybrid'):
+            raise ValueError("Wrong `mode` value, expected 'vector', 'text' or 'hybrid'")
+        k = min(k or self.knn_k, self.max_k)
+        limit = limit or k
+        fts_query = self._fts_query(text)
+        if mode == 'text' and fts_query is None:
+            return [], [], []
+        if mode == 'hybrid' and fts_query is None:
+            mode = 'vector'
+
+        with self.connect(read_only=True) as conn:
             conn.row_factory = sqlite3.Row
             cur = conn.cursor()
 
-            sql = """
-            WITH nearest_query AS (
-                SELECT
-                    rowid AS tfidf_id,
-                    vec_distance_cosine(emb_50d, vec_f32(?)) AS query_distance
+            vector_filters = self._search_filters(cur, filters)
+            if vector_filters is None:
+                return [], [], []
+            vector_constraints, filter_params = vector_filters
+            text_constraints, _ = self._search_filters(cur, filters, columns=self.tfidf_metadata)
+
+            vector = f"""
+            vector AS MATERIALIZED ( -- a single KNN search, not one per joined offer
+                SELECT rowid AS tfidf_id, distance
                 FROM TFIDF
-                ORDER BY query_distance ASC
-                LIMIT 50
+                WHERE emb_50d MATCH vec_f32(:query) AND k = :k{vector_constraints}
+            )"""
+            lexical = f"""
+            lexical AS MATERIALIZED ( -- answered from the inverted index
+                SELECT OFFER_FTS.rowid AS offer_id, OFFER_FTS.rank AS bm25
+                FROM OFFER_FTS
+                JOIN OFFER o ON o.offer_id = OFFER_FTS.rowid
+                JOIN CITY ci ON ci.city_id = o.city_id
+                WHERE OFFER_FTS MATCH :text{text_constraints}
+                ORDER BY OFFER_FTS.rank
+                LIMIT :k
+            )"""
+            match mode:
+                case 'vector':
+                    candidates = f"""{vector},
+            candidates AS (
+                SELECT o.offer_id, -v.distance AS relevance
+                FROM vector v
+                JOIN OFFER o ON o.tfidf_id = v.tfidf_id
+            )"""
+                case 'text':
+                    candidates = f"""{lexical},
+            candidates AS (
+                SELECT offer_id, -bm25 AS relevance FROM lexical
+            )"""
+                case 'hybrid':
+                    candidates = f"""{vector},{lexical},
+            ranked AS (
+                SELECT o.offer_id, row_number() OVER (ORDER BY v.distance) AS rank
+                FROM vector v
+                JOIN OFFER o ON o.tfidf_id = v.tfidf_id
+                UNION ALL
+                SELECT offer_id, row_number() OVER (ORDER BY bm25) AS rank FROM lexical
             ),
+            candidates AS (
+                SELECT offer_id, SUM(1.0 / (:rrf_k + rank)) AS relevance
+                FROM ranked
+                GROUP BY offer_id
+            )"""
+
+            sql = f"""
+            WITH {candidates},
             scored AS (
                 SELECT
-                    n.tfidf_id,
-                    n.query_distance,
+                    c.offer_id,
+                    c.relevance,
                     CASE
-                        WHEN ? IS NULL THEN NULL
-                        ELSE vec_distance_cosine(t.emb_50d, vec_f32(?))
+                        WHEN :resume IS NULL OR t.rowid IS NULL THEN NULL -- text matches may have no embeddings yet
+                        ELSE vec_distance_cosine(t.emb_50d, vec_f32(:resume))
                     END AS resume_distance
-                FROM nearest_query n
-                JOIN TFIDF t ON t.rowid = n.tfidf_id
+                FROM candidates c
+                JOIN OFFER o ON o.offer_id = c.offer_id
+                LEFT JOIN TFIDF t ON t.rowid = o.tfidf_id
             )
             SELECT
                 o.offer_id,
@@ -364,39 +783,109 @@ class OfferDB:
                 r.name AS region_name,
                 d.offer_description,
                 d.profile_description,
-                scored.query_distance,
-                scored.resume_distance AS score,
-                (SELECT GROUP_CONCAT(de.degree, '||')
-                FROM OFFER_DEGREE od
-                JOIN degree de ON de.degree_id = od.degree_id
-                WHERE od.offer_id = o.offer_id) AS degrees,
-                (SELECT GROUP_CONCAT(s.skill, '||')
-                FROM OFFER_SKILL os
-                JOIN skill s ON s.skill_id = os.skill_id
-                WHERE os.offer_id = o.offer_id) AS skills
+                scored.relevance,
+                scored.resume_distance AS score
             FROM scored
-            JOIN OFFER o          ON o.tfidf_id       = scored.tfidf_id
+            JOIN OFFER o       ON o.offer_id       = scored.offer_id
             JOIN COMPANY c     ON c.company_id     = o.company_id
             JOIN DESCRIPTION d ON d.description_id = o.description_id
-            JOIN CITY ci        ON ci.city_id       = o.city_id
-            JOIN REGION r       ON r.region_id      = ci.region_id 
+            JOIN CITY ci       ON ci.city_id       = o.city_id
+            JOIN REGION r      ON r.region_id      = ci.region_id
             ORDER BY
-                CASE
-                    WHEN scored.resume_distance IS NOT NULL THEN scored.resume_distance
-                    ELSE scored.query_distance
-                END ASC;
+                scored.resume_distance IS NULL,
+                scored.resume_distance ASC,
+                scored.relevance DESC
+            LIMIT :limit OFFSET :offset;
             """
 
-            query_blob = query.astype("float32").tobytes()
+            query_blob = query.astype("float32").tobytes() if query is not None else None
             resume_blob = None
             if resume is not None:
                 resume_blob = resume.astype("float32").tobytes()
 
-            params = (query_blob, resume_blob, resume_blob)
+            params = {
+                'query': query_blob, 'resume': resume_blob, 'text': fts_query, 'rrf_k': self.rrf_k,
+                'k': k, 'limit': limit, 'offset': page * limit, **filter_params
+            }
             cur.execute(sql, params)
             rows = cur.fetchall()
+            ids = [row['offer_id'] for row in rows]
+            degrees, skills = self._offer_relations(cur, ids)
+
+            return [self._row_to_offer(row, degrees.get(row['offer_id']), skills.get(row['offer_id'])) for row in rows], ids, [row['score'] for row in rows]
+
+    def iter_offers(self, columns:list[str]=None, source:str=None, page_size:int=None) -> Generator[tuple[int, Offer]|dict, None, None]:
+        """Iterate over the offers, latest first and undated last, one page at a time (keyset pagination on date and
+        offer ID, so each page is an index range scan and memory stays flat whatever the size of the table)
+
+        Args:
+            columns (list[str], optional): Columns to select (keys of `offer_columns`, 'degrees', 'skills'). Full offers if None. Default to None
+            source (str, optional): Only offers from this source ('NTNE', 'APEC'). Default to None
+            page_size (int, optional): Offers read per query. Default to `page_size`
+
+        Yields:
+            tuple[int, Offer]: Offer ID and offer, if `columns` is None
+            dict: Selected column -> value, otherwise
+        """
 
-            return [self._row_to_offer(row) for row in rows], [row['offer_id'] for row in rows], [row['score'] for row in rows]
+        page_size = page_size or self.page_size
+        selected = list(self.offer_columns) if columns is None else [c for c in columns if c not in ('degrees', 'skills')]
+        unknown = set(selected) - set(self.offer_columns)
+        if unknown:
+            raise ValueError(f'Unknown offer columns: {", ".join(sorted(unknown))}')
+        relations = ('degrees', 'skills') if columns is None else tuple(r for r in ('degrees', 'skills') if r in columns)
+
+        aliases = {self.offer_columns[column].split('.')[0] for column in selected}
+        if 'r' in aliases:
+            aliases.add('ci')
+        joins = '\n'.join(sql for alias, sql in self.offer_joins.items() if alias in aliases)
+        select = ''.join(f', {self.offer_columns[column]} AS {column}' for column in selected)
+
+        def query(after:bool) -> str:
+            where = []
+            if source:
+                where.append("o.source = :source")
+            if after:
+                # The bound on the date alone lets SQLite seek the index, the row value breaks ties on offer ID
+                where.append("COALESCE(o.date, '') <= :date AND (COALESCE(o.date, ''), o.offer_id) < (:date, :offer_id)")
+            return f"""
+                SELECT o.offer_id AS _offer_id, COALESCE(o.date, '') AS _date{select}
+                FROM OFFER o
+                {joins}
+                {'WHERE ' + ' AND '.join(where) if where else ''}
+                ORDER BY COALESCE(o.date, '') DESC, o.offer_id DESC
+                LIMIT :limit
+            """
+
+        params = {'source': source, 'limit': page_size}
+        sql = query(after=False)
+        while True:
+            # A connection per page: no read transaction held while the caller consumes the offers
+            with self.connect(read_only=True) as conn:
+                cur = conn.cursor()
+                cur.execute(sql, params)
+                # dicts: faster key lookups than `sqlite3.Row` when building the offers
+                names = [d[0] for d in cur.description]
+                rows = [dict(zip(names, row)) for row in cur.fetchall()]
+                ids = [row['_offer_id'] for row in rows]
+                degrees, skills = self._offer_relations(conn.cursor(), ids, relations) if relations and rows else ({}, {})
+
+            for row in rows:
+                offer_id = row['_offer_id']
+                if columns is None:
+                    yield offer_id, self._row_to_offer(row, degrees.get(offer_id), skills.get(offer_id))
+                    continue
+                item = {column: row[column] for column in selected}
+                if 'degrees' in columns:
+                    item['degrees'] = degrees.get(offer_id, [])
+                if 'skills' in columns:
+                    item['skills'] = skills.get(offer_id, [])
+                yield item
+
+            if len(rows) < page_size:
+                return
+            params.update(date=rows[-1]['_date'], offer_id=rows[-1]['_offer_id'])
+            sql = query(after=True)
 
     def get_offers(self, id:str=None) -> tuple[list[Offer], list[int]]:
         """Get offer by ID, returns all offers if no ID
@@ -409,52 +898,13 @@ class OfferDB:
             list[int]: List of offers IDs
         """
 
-        with self.connect() as conn:
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-
-            cur.execute("""
-            SELECT
-                o.offer_id,
-                o.title,
-                o.job_name,
-                o.job_type,
-                o.contract_type,
-                o.salary_label,
-                o.salary_min,
-                o.salary_max,
-                o.min_experience,
-                o.latitude,
-                o.longitude,
-                o.date,
-                o.source,
-                c.name AS company_name,
-                c.description AS company_description,
-                c.industry AS company_industry,
-                c.logo_url AS logo_url,
-                ci.name AS city_name,
-                r.code AS region_code,
-                r.name AS region_name,
-                d.offer_description,
-                d.profile_description,
-                (SELECT GROUP_CONCAT(de.degree, '||')
-                FROM OFFER_DEGREE od
-                JOIN degree de ON de.degree_id = od.degree_id
-                WHERE od.offer_id = o.offer_id) AS degrees,
-                (SELECT GROUP_CONCAT(s.skill, '||')
-                FROM OFFER_SKILL os
-                JOIN skill s ON s.skill_id = os.skill_id
-                WHERE os.offer_id = o.offer_id) AS skills
-            FROM OFFER o
-            JOIN COMPANY c     ON c.company_id     = o.company_id
-            JOIN DESCRIPTION d ON d.description_id = o.description_id
-            JOIN CITY ci        ON ci.city_id       = o.city_id
-            JOIN REGION r       ON r.region_id      = ci.region_id
-            ORDER BY o.date DESC;
-            """)
-
-            rows = cur.fetchall()
-            return [self._row_to_offer(row) for row in rows], [row['offer_id'] for row in rows]
+        offers = []
+        ids = []
+        for offer_id, offer in self.iter_offers():
+            if id is None or offer_id == int(id):
+                offers.append(offer)
+                ids.append(offer_id)
+        return offers, ids
 
     def get_clusters(self, id:str=None) -> list[Cluster]:
         """Search an offer cluster by id, returns all offer clusters if no ID.
@@ -466,7 +916,7 @@ class OfferDB:
             list[Cluster]: Offer clusters
         """
 
-        with self.connect() as conn:
+        with self.connect(read_only=True) as conn:
             conn.row_factory = sqlite3.Row
             cur = conn.cursor()
 
@@ -521,7 +971,7 @@ class OfferDB:
             list: Result
         """
 
-        with self.connect() as conn:
+        with self.connect(read_only=True) as conn:
             cur = conn.cursor()
 
             if columns:
@@ -571,7 +1021,7 @@ class OfferDB:
             int: Total count of offers
         """
 
-        with self.connect() as conn:
+        with self.connect(read_only=True) as conn:
             cur = conn.cursor()
             if source:
                 cur.execute(
@@ -584,6 +1034,31 @@ class OfferDB:
             count = cur.fetchone()[0]
         return count
             
+    def known_ids(self, source:str, external_ids:list[str]) -> set[str]:
+        """Filter the source-side IDs already stored in database
+
+        Args:
+            source (str): The source ('NTNE', 'APEC')
+            external_ids (list[str]): Offer IDs on the source side
+
+        Returns:
+            set[str]: The IDs already known
+        """
+
+        known = set()
+        with self.connect(read_only=True) as conn:
+            cur = conn.cursor()
+            # Stay below the SQLite bound variables limit
+            for i in range(0, len(external_ids), 500):
+                chunk = external_ids[i:i+500]
+                placeholders = ', '.join('?' * len(chunk))
+                cur.execute(
+                    f"SELECT external_id FROM OFFER WHERE source = ? AND external_id IN ({placeholders})",
+                    [source, *chunk]
+                )
+                known.update(row[0] for row in cur.fetchall())
+        return known
+
     def get_latest_date(self, source:str=None, isostring=False) -> date|None:
         """Search the latest date from database
 
@@ -594,7 +1069,7 @@ class OfferDB:
             datetime: The latest date
         """
 
-        with self.connect() as conn:
+        with self.connect(read_only=True) as conn:
             cur = conn.cursor()
             if source:
                 cur.execute(
@@ -616,7 +1091,7 @@ class OfferDB:
     
     def get_unprocessed(self, source=None) -> tuple[list[int], list[str]]:
 
-        with self.connect() as conn:
+        with self.connect(read_only=True) as conn:
             cur = conn.cursor()
             if source:
                 cur.execute(
@@ -0,0 +1,68 @@
+import json
+import sqlite3
+
+
+
+
+def scan(cur:sqlite3.Cursor, offer_ids:tuple[int, int]=None) -> dict[str, dict]:
+    """Count the offers, latest date and NULLs of every OFFER column per source, in a single aggregate scan
+
+    Args:
+        cur (sqlite3.Cursor): Database cursor
+        offer_ids (tuple[int, int], optional): Only scan this range of offer ids (eg. the rows just inserted). Default to None
+
+    Returns:
+        dict[str, dict]: Source -> `{total, date, na: {column: count}}`
+    """
+
+    columns = [row[1] for row in cur.execute("PRAGMA table_info('OFFER')")]
+    nulls = ', '.join(f'SUM("{column}" IS NULL)' for column in columns)
+    where, params = ("WHERE offer_id BETWEEN ? AND ?", list(offer_ids)) if offer_ids else ("", [])
+    rows = cur.execute(f"SELECT source, COUNT(*), MAX(date), {nulls} FROM OFFER {where} GROUP BY source", params).fetchall()
+    return {row[0]: {'total': row[1], 'date': row[2], 'na': dict(zip(columns, row[3:]))} for row in rows}
+
+
+def merge(stats:dict|None, other:dict) -> dict:
+    """Add the stats of new offers to the stats of a source"""
+
+    if not stats:
+        return other
+    dates = [d for d in (stats['date'], other['date']) if d]
+    na = dict(stats['na'])
+    for column, count in other['na'].items():
+        na[column] = na.get(column, 0) + count
+    return {'total': stats['total'] + other['total'], 'date': max(dates) if dates else None, 'na': na}
+
+
+def load(cur:sqlite3.Cursor, source:str=None) -> dict[str, dict]:
+    """Stored stats, of every source if `source` is None"""
+
+    rows = cur.execute(
+        "SELECT source, total, latest_date, null_counts FROM SOURCE_STATS WHERE (?1 IS NULL OR source = ?1)", [source]
+    ).fetchall()
+    return {row[0]: {'total': row[1], 'date': row[2], 'na': json.loads(row[3])} for row in rows}
+
+
+def save(cur:sqlite3.Cursor, stats:dict[str, dict], replace:bool=False) -> None:
+    """Store the stats of each source
+
+    Args:
+        cur (sqlite3.Cursor): Cursor of the write transaction
+        stats (dict[str, dict]): Source -> stats, as returned by `scan`
+        replace (bool): Also delete the sources missing from `stats` (full refresh). Default to False
+    """
+
+    if replace:
+        cur.execute("DELETE FROM SOURCE_STATS")
+    cur.executemany(
+        """
+        INSERT INTO SOURCE_STATS(source, total, latest_date, null_counts, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(source) DO UPDATE SET
+            total = excluded.total,
+            latest_date = excluded.latest_date,
+            null_counts = excluded.null_counts,
+            updated_at = excluded.updated_at
+        """,
+        [(source, s['total'], s['date'], json.dumps(s['na'])) for source, s in stats.items()]
+    )
@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+from collections import deque
+from typing import Callable, Iterator
+import threading
+import sqlite3
+import time
+import os
+
+
+
+
+class ConnectionPool:
+
+    """Thread-aware pool of sqlite connections, created with `factory` and reused across requests.
+
+    A thread asking for a connection while it already holds one gets the same connection (nested `connect()` calls
+    share the outer transaction instead of locking each other). Connections idle for more than `check_interval`
+    seconds are checked before being handed out, and replaced if broken.
+    """
+
+    def __init__(self, factory:Callable[[], sqlite3.Connection], max_size:int=8, timeout:float=30., check_interval:float=30.) -> None:
+        """Create an empty pool
+
+        Args:
+            factory (Callable): Opens a new connection (must use `check_same_thread=False`)
+            max_size (int): Max connections open at once. Defaults to 8
+            timeout (float): Max seconds to wait for a free connection. Defaults to 30
+            check_interval (float): Idle seconds after which a connection is checked before use. Defaults to 30
+        """
+
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        self.__reset()
+
+    def __reset(self) -> None:
+        self._idle = deque() # (connection, last used), most recent last
+        self._size = 0
+        self._pid = os.getpid()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection: commits on success and rolls back on error like `with sqlite3.connect(...)`, then returns it to the pool"""
+
+        held = getattr(self._local, 'connection', None)
+        if held is not None:
+            # Nested call in the same thread, the outer block commits
+            yield held
+            return
+
+        conn = self._acquire()
+        self._local.connection = conn
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._local.connection = None
+            self._release(conn)
+
+    def _acquire(self) -> sqlite3.Connection:
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            if self._pid != os.getpid():
+                # Forked: the parent connections cannot be used here
+                self.__reset()
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    raise Exception(f'No database connection available after {self.timeout}s ({self.max_size} in use)')
+
+        if conn is not None and time.monotonic() - last_used > self.check_interval and not self._healthy(conn):
+            self.__close(conn)
+            conn = None
+        if conn is None:
+            try:
+                conn = self.factory()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+        return conn
+
+    def _release(self, conn:sqlite3.Connection) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            # Undo per-call settings (eg. `conn.row_factory = sqlite3.Row`)
+            conn.row_factory = None
+        except sqlite3.Error:
+            self.__discard(conn)
+            return
+        with self._condition:
+            if self._pid != os.getpid():
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._condition.notify()
+
+    @staticmethod
+    def _healthy(conn:sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def __discard(self, conn:sqlite3.Connection) -> None:
+        self.__close(conn)
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    @staticmethod
+    def __close(conn:sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close(self) -> None:
+        """Close the idle connections"""
+
+        with self._condition:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self.__close(conn)
+                self._size -= 1
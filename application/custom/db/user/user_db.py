@@ -1,7 +1,9 @@
+from typing import ContextManager
 import sqlite3
 import os
 
 from .models import Template
+from ..pool import ConnectionPool
 
 
 
@@ -9,13 +11,20 @@ from .models import Template
 class UserDB():
 
     path = 'db/user.db'
+    pool_size = 4
 
     def __init__(self) -> None:
         root = os.environ.get('DATA_PATH', 'data/')
         self.db_path = os.path.join(root, self.path)
+        self.pool = ConnectionPool(self._create_connection, max_size=self.pool_size)
 
-    def connect(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.db_path)
+    def _create_connection(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, check_same_thread=False)
+
+    def connect(self) -> ContextManager[sqlite3.Connection]:
+        """Borrow a pooled connection, to use as `with user_db.connect() as conn:` (commits at the end of the block)"""
+
+        return self.pool.connection()
     
     def create_template(self, template:Template) -> None:
         """Create a template object in DB
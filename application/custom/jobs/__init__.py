@@ -0,0 +1,2 @@
+from .job import Job
+from .job_runner import JobRunner, JobReporter
\ No newline at end of file
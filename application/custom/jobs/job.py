@@ -0,0 +1,49 @@
+from dataclasses import dataclass, field
+from typing import Any, Optional
+import time
+
+
+
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+INTERRUPTED = 'interrupted' # the process running it stopped before the end
+
+FINISHED = (DONE, FAILED, INTERRUPTED)
+
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str                         # operation name (eg. 'ingest', 'process_nlp')
+    key: Optional[str] = None         # what the operation runs on (eg. the source)
+    status: str = PENDING
+    progress: dict = field(default_factory=dict) # last progress reported by the job
+    result: Any = None
+    error: Optional[str] = None
+    owner: Optional[int] = None       # pid of the process running the job
+    boot: Optional[str] = None        # token of the runner running the job (pids are reused after a restart)
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    version: int = 0                  # incremented on every change, used by subscribers
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def to_dict(self) -> dict:
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'key': self.key,
+            'status': self.status,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
@@ -0,0 +1,362 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import replace
+from typing import Any, Callable, Iterator
+import traceback
+import threading
+import sqlite3
+import uuid
+import json
+import time
+import os
+
+from .job import Job, PENDING, RUNNING, DONE, FAILED, INTERRUPTED
+
+
+
+
+class JobReporter:
+
+    """Handle given to a running job to publish its progress"""
+
+    def __init__(self, runner:'JobRunner', job_id:str) -> None:
+        self.runner = runner
+        self.job_id = job_id
+
+    def report(self, **progress) -> None:
+        """Publish the job progress (replaces the previous one), eg. `report(count=10, progress=5.2)`"""
+
+        self.runner._update(self.job_id, progress=progress)
+
+
+
+
+class JobRunner:
+
+    """Background jobs (crawls, NLP processing) run by worker threads, independently of the HTTP requests.
+
+    Jobs are stored in a sqlite table, so their state survives the request that started them and can be read by
+    other processes. Any number of clients can subscribe to the progress of a job.
+
+    Single-flight jobs hold leases (rows of the LEASE table, renewed while they run): submitting an operation whose
+    lease is held, from any thread or worker process, returns the running job instead of starting a new one.
+    """
+
+    path = 'db/jobs.db'
+    persist_interval = 1. # min seconds between two progress writes of a job
+    retention = 7 * 24 * 3600 # finished jobs are deleted after this long
+    lease_ttl = 60. # seconds a lease outlives its last renewal (eg. when the worker process was killed)
+
+    def __init__(self, workers:int=4) -> None:
+        root = os.environ.get('DATA_PATH', 'data/')
+        self.db_path = os.path.join(root, self.path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.boot = uuid.uuid4().hex # identifies this runner, a job is alive only if its (pid, boot) is the current one
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self.jobs: dict[str, Job] = {} # jobs of this process
+        self._persisted: dict[str, float] = {}
+        self._condition = threading.Condition()
+        self.__init_table()
+        self.__recover()
+        threading.Thread(target=self.__renew_leases, name='job-leases', daemon=True).start()
+
+    def __init_table(self) -> None:
+        with closing(self.connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS JOB (
+                    job_id      TEXT PRIMARY KEY,
+                    kind        TEXT NOT NULL,
+                    key         TEXT,
+                    status      TEXT NOT NULL,
+                    progress    TEXT,
+                    result      TEXT,
+                    error       TEXT,
+                    owner       INTEGER,
+                    boot        TEXT,
+                    created_at  REAL NOT NULL,
+                    started_at  REAL,
+                    finished_at REAL,
+                    version     INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            if 'boot' not in [row[1] for row in conn.execute("PRAGMA table_info('JOB')")]:
+                conn.execute("ALTER TABLE JOB ADD COLUMN boot TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_kind_key ON JOB(kind, key, created_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS LEASE (
+                    name       TEXT PRIMARY KEY,
+                    job_id     TEXT NOT NULL,
+                    owner      INTEGER,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            # Current runner of each pid: a job of an older runner whose pid was reused is dead
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS RUNNER (
+                    pid        INTEGER PRIMARY KEY,
+                    boot       TEXT NOT NULL,
+                    started_at REAL NOT NULL
+                )
+            """)
+            conn.execute("INSERT OR REPLACE INTO RUNNER(pid, boot, started_at) VALUES (?, ?, ?)", [os.getpid(), self.boot, time.time()])
+
+    def __recover(self) -> None:
+        # Jobs left unfinished by a dead process will never end
+        with closing(self.connect()) as conn, conn:
+            rows = conn.execute("SELECT job_id, owner, boot FROM JOB WHERE status IN (?, ?)", [PENDING, RUNNING]).fetchall()
+            dead = [job_id for job_id, owner, boot in rows if not self._alive(conn, owner, boot)]
+            conn.executemany(
+                "UPDATE JOB SET status = ?, finished_at = ?, version = version + 1 WHERE job_id = ?",
+                [(INTERRUPTED, time.time(), job_id) for job_id in dead]
+            )
+            conn.execute("DELETE FROM JOB WHERE finished_at < ?", [time.time() - self.retention])
+            conn.executemany("DELETE FROM LEASE WHERE job_id = ?", [(job_id,) for job_id in dead])
+
+    def _alive(self, conn:sqlite3.Connection, pid:int|None, boot:str|None) -> bool:
+        # The pid alone is not enough: after a container restart the new workers get the pids of the dead ones
+        if not pid or not boot:
+            return False
+        if pid == os.getpid():
+            return boot == self.boot
+        row = conn.execute("SELECT boot FROM RUNNER WHERE pid = ?", [pid]).fetchone()
+        if row is None or row[0] != boot:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def __save(self, job:Job, conn:sqlite3.Connection=None) -> None:
+        if conn is None:
+            with closing(self.connect()) as conn, conn:
+                return self.__save(job, conn)
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO JOB(job_id, kind, key, status, progress, result, error, owner, boot, created_at, started_at, finished_at, version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [job.job_id, job.kind, job.key, job.status, json.dumps(job.progress), json.dumps(job.result, default=str),
+             job.error, job.owner, job.boot, job.created_at, job.started_at, job.finished_at, job.version]
+        )
+        self._persisted[job.job_id] = time.monotonic()
+
+    def __load(self, job_id:str) -> Job|None:
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                """
+                SELECT job_id, kind, key, status, progress, result, error, owner, boot, created_at, started_at, finished_at, version
+                FROM JOB WHERE job_id = ?
+                """,
+                [job_id]
+            ).fetchone()
+        if row is None:
+            return None
+        job = Job(*row)
+        job.progress = json.loads(job.progress) if job.progress else {}
+        job.result = json.loads(job.result) if job.result else None
+        return job
+
+    def submit(self, kind:str, fn:Callable[..., Any], *args, key:str=None, single_flight:bool=False, leases:list[str]=None, **kwargs) -> Job:
+        """Queue a job, or attach to the running one when single-flight
+
+        Args:
+            kind (str): Operation name
+            fn (Callable): Called as `fn(reporter, *args, **kwargs)` by a worker thread, its return value (JSON serializable) is the job result
+            key (str, optional): What the operation runs on (eg. the source)
+            single_flight (bool): Only one job of this operation runs at once, duplicates get the running job. Defaults to False
+            leases (list[str], optional): Lease names of a single-flight job. Defaults to `['<kind>:<key>']`
+
+        Returns:
+            Job: The queued job, or the running job holding one of the leases
+        """
+
+        job = Job(job_id=uuid.uuid4().hex, kind=kind, key=key, owner=os.getpid(), boot=self.boot)
+        with self._condition:
+            self.jobs[job.job_id] = job
+        if single_flight:
+            holder = self.__acquire(job, leases or [f'{kind}:{key}'])
+            if holder is not None:
+                with self._condition:
+                    self.jobs.pop(job.job_id, None)
+                return self.get(holder)
+        else:
+            self.__save(job)
+        self.executor.submit(self.__run, job.job_id, fn, args, kwargs)
+        return replace(job)
+
+    def __acquire(self, job:Job, names:list[str]) -> str|None:
+        # Take every lease and save the job in one write transaction, or return the job id holding one of them
+        now = time.time()
+        with closing(self.connect()) as conn:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"""
+                    SELECT LEASE.job_id, JOB.owner, JOB.boot, LEASE.expires_at, JOB.status FROM LEASE
+                    LEFT JOIN JOB ON JOB.job_id = LEASE.job_id
+                    WHERE LEASE.name IN ({','.join('?' * len(names))})
+                    """,
+                    names
+                ).fetchall()
+                for job_id, owner, boot, expires_at, status in rows:
+                    if expires_at > now and status in (PENDING, RUNNING) and self._alive(conn, owner, boot):
+                        conn.execute("COMMIT")
+                        return job_id
+                self.__save(job, conn)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO LEASE(name, job_id, owner, expires_at) VALUES (?, ?, ?, ?)",
+                    [(name, job.job_id, job.owner, now + self.lease_ttl) for name in names]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return None
+
+    def __release(self, job_id:str) -> None:
+        with closing(self.connect()) as conn, conn:
+            conn.execute("DELETE FROM LEASE WHERE job_id = ?", [job_id])
+
+    def __renew_leases(self) -> None:
+        # Keep the leases of the jobs run by this process alive
+        while True:
+            time.sleep(self.lease_ttl / 3)
+            with self._condition:
+                job_ids = list(self.jobs)
+            if not job_ids:
+                continue
+            try:
+                with closing(self.connect()) as conn, conn:
+                    conn.executemany(
+                        "UPDATE LEASE SET expires_at = ? WHERE job_id = ?",
+                        [(time.time() + self.lease_ttl, job_id) for job_id in job_ids]
+                    )
+            except sqlite3.Error as e:
+                print(f'WARNING: Failed to renew job leases: {e}')
+
+    def __run(self, job_id:str, fn:Callable[..., Any], args:tuple, kwargs:dict) -> None:
+        self._update(job_id, status=RUNNING, started_at=time.time())
+        try:
+            result = fn(JobReporter(self, job_id), *args, **kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status=FAILED, error=str(e) or e.__class__.__name__, finished_at=time.time())
+        else:
+            self._update(job_id, status=DONE, result=result, finished_at=time.time())
+        finally:
+            # After the final state is saved, so that a duplicate never sees a free lease and an unfinished job
+            self.__release(job_id)
+
+    def _update(self, job_id:str, **changes) -> None:
+        with self._condition:
+            job = self.jobs[job_id]
+            for name, value in changes.items():
+                setattr(job, name, value)
+            job.version += 1
+            snapshot = replace(job)
+            self._condition.notify_all()
+        # Progress is written at most every `persist_interval`, status changes always
+        if 'status' in changes or time.monotonic() - self._persisted.get(job_id, 0) >= self.persist_interval:
+            self.__save(snapshot)
+        if snapshot.finished:
+            with self._condition:
+                self.jobs.pop(job_id, None)
+                self._persisted.pop(job_id, None)
+
+    def get(self, job_id:str) -> Job|None:
+        """Current state of a job (a copy), from memory when run by this process, from the table otherwise"""
+
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return replace(job)
+        return self.__load(job_id)
+
+    def latest(self, kind:str, key:str=None) -> Job|None:
+        """Most recent job of an operation"""
+
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                "SELECT job_id FROM JOB WHERE kind = ? AND key IS ? ORDER BY created_at DESC LIMIT 1", [kind, key]
+            ).fetchone()
+        return self.get(row[0]) if row else None
+
+    def wait(self, job_id:str, version:int=-1, timeout:float=None) -> Job|None:
+        """Wait for a job to change
+
+        Args:
+            job_id (str): The job to watch
+            version (int): Last version seen, returns as soon as the job is newer. Defaults to -1
+            timeout (float, optional): Max seconds to wait, wait forever if `None`
+
+        Returns:
+            Job|None: The job state (unchanged after a timeout), `None` if it does not exist
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while job_id in self.jobs and self.jobs[job_id].version <= version:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            if job_id in self.jobs:
+                return replace(self.jobs[job_id])
+
+        # Run by another process (or finished): poll the table
+        job = self.__load(job_id)
+        while job is not None and job.version <= version and not job.finished:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            time.sleep(min(self.persist_interval, remaining if remaining is not None else self.persist_interval))
+            job = self.__load(job_id)
+        return job
+
+    def subscribe(self, job_id:str, keepalive:float=15.) -> Iterator[Job|None]:
+        """Follow a job until it finishes
+
+        Args:
+            job_id (str): The job to follow
+            keepalive (float): Seconds without change after which `None` is yielded (eg. to send an SSE comment)
+
+        Yields:
+            Job|None: Each new state of the job, `None` when nothing changed for `keepalive` seconds
+        """
+
+        version = -1
+        while True:
+            job = self.wait(job_id, version, timeout=keepalive)
+            if job is None:
+                return
+            if job.version == version:
+                yield None
+                continue
+            version = job.version
+            yield job
+            if job.finished:
+                return
+
+    def result(self, job_id:str, timeout:float=None) -> Job|None:
+        """Wait for a job to finish
+
+        Returns:
+            Job|None: The finished job (or still running after `timeout`)
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        job = self.get(job_id)
+        while job is not None and not job.finished:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            job = self.wait(job_id, job.version, timeout=remaining)
+        return job
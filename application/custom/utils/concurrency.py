@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Full
+from typing import Iterable, Iterator, TypeVar
+import threading
+
+
+
+T = TypeVar('T')
+K = TypeVar('K')
+
+
+def merge_concurrent(iterators:dict[K, Iterable[T]], buffer:int=8) -> Iterator[tuple[K, T]]:
+    """Drain several iterators in parallel threads, yielding their items as they come.
+
+    Items go through a bounded queue, so a producer blocks when the consumer is behind. Exceptions raised by a producer
+    are raised back here, and closing the generator stops every producer.
+
+    Args:
+        iterators (dict[K, Iterable]): Key -> iterator to drain (eg. keyword -> search results)
+        buffer (int): Max items waiting in the queue. Defaults to 8
+
+    Yields:
+        tuple: (key, item)
+    """
+
+    queue = Queue(maxsize=buffer)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry:tuple) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(entry, timeout=.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def drain(key:K, iterator:Iterable[T]) -> None:
+        try:
+            for item in iterator:
+                if not put((key, item, None)):
+                    return
+        except Exception as e:
+            put((key, done, e))
+            return
+        finally:
+            # Generators are closed by the thread running them
+            if hasattr(iterator, 'close'):
+                iterator.close()
+        put((key, done, None))
+
+    with ThreadPoolExecutor(max_workers=max(len(iterators), 1)) as executor:
+        for key, iterator in iterators.items():
+            executor.submit(drain, key, iterator)
+        remaining = len(iterators)
+        try:
+            while remaining:
+                key, item, error = queue.get()
+                if item is done:
+                    if error is not None:
+                        raise error
+                    remaining -= 1
+                    continue
+                yield key, item
+        finally:
+            stop.set()
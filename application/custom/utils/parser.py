@@ -1,4 +1,7 @@
 from typing import Any
+from functools import lru_cache
+from html.parser import HTMLParser
+from html.entities import html5
 from bs4 import BeautifulSoup
 import pymupdf
 import re
@@ -59,27 +62,121 @@ class ParseNumeric:
 
 
 
+class _TextExtractor(HTMLParser):
+
+    """Streaming HTML tokenizer collecting text nodes like `BeautifulSoup.get_text(strip=True)` does"""
+
+    # BeautifulSoup stores the text of these tags as special strings, left out of `get_text`
+    skip_tags = {'script', 'style', 'template', 'rt', 'rp'}
+
+    def __init__(self) -> None:
+        # References are resolved by hand, the way BeautifulSoup does
+        super().__init__(convert_charrefs=False)
+        self.texts = []
+        self.buffer = []
+        self.skip = 0
+
+    def _flush(self) -> None:
+        # A text node ends at every tag, comment or declaration
+        if self.buffer:
+            text = ''.join(self.buffer).strip()
+            if text:
+                self.texts.append(text)
+            self.buffer = []
+
+    def handle_starttag(self, tag, attrs) -> None:
+        self._flush()
+        if tag in self.skip_tags:
+            self.skip += 1
+
+    def handle_endtag(self, tag) -> None:
+        self._flush()
+        if tag in self.skip_tags and self.skip:
+            self.skip -= 1
+
+    def handle_startendtag(self, tag, attrs) -> None:
+        self._flush()
+
+    def handle_data(self, data) -> None:
+        if not self.skip:
+            self.buffer.append(data)
+
+    def handle_entityref(self, name) -> None:
+        character = html5.get(name + ';')
+        self.handle_data(character if character is not None else f'&{name}')
+
+    def handle_charref(self, name) -> None:
+        try:
+            code = int(name[1:], 16) if name[:1] in ('x', 'X') else int(name)
+            if 128 <= code <= 159:
+                character = bytes([code]).decode('windows-1252')
+            else:
+                character = chr(code)
+        except (ValueError, OverflowError, UnicodeDecodeError):
+            character = '\N{REPLACEMENT CHARACTER}'
+        self.handle_data(character)
+
+    def unknown_decl(self, data) -> None:
+        self._flush()
+        if data.startswith('CDATA[') and not self.skip:
+            self.buffer.append(data[6:])
+            self._flush()
+
+    def handle_comment(self, data) -> None:
+        self._flush()
+
+    def handle_decl(self, decl) -> None:
+        self._flush()
+
+    def handle_pi(self, data) -> None:
+        self._flush()
+
+    def get_text(self, html:str) -> str:
+        self.feed(html)
+        self.close()
+        self._flush()
+        return ' '.join(self.texts)
+
+
+
+
 class ParseHTML:
 
     """Parse text on a HTML string"""
 
-    def __new__(cls, html:str) -> str:
+    cache_size = 4096
+
+    def __new__(cls, html:str, engine='stream') -> str:
         """Parse text in HTML string and remove all tags
 
         Args:
             html (str): the HTML string to parse
+            engine (str): 'stream' (fast tokenizer, memoised) or 'soup' (BeautifulSoup). Defaults to 'stream'.
 
         Returns:
             str: the cleaned text
         """
         if not html:
             return None
-        return cls.__parse_html(html)
-    
+        match engine:
+            case 'stream':
+                return cls._parse_cached(html)
+            case 'soup':
+                return cls.__parse_soup(html)
+            case _:
+                raise ValueError("Wrong `engine` value, expected 'stream' or 'soup'")
+
     @staticmethod
-    def __parse_html(html:str) -> str:
+    def __parse_soup(html:str) -> str:
         soup = BeautifulSoup(html, 'html.parser')
         return soup.get_text(separator=" ", strip=True).replace('\n', ' ').strip()
+
+    @staticmethod
+    def _parse_stream(html:str) -> str:
+        return _TextExtractor().get_text(html).replace('\n', ' ').strip()
+
+    # Company descriptions repeat across hundreds of offers: keep recent results, keyed on the content
+    _parse_cached = staticmethod(lru_cache(maxsize=cache_size)(_parse_stream.__func__))
     
 
 class ParsePDF:
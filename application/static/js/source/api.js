@@ -77,21 +77,37 @@ async function processNLP(source, database, countLabel, progress) {
     database.classList.remove('loading');
     database.classList.add('waiting');
     
+    const onError = () => {
+        countLabel.textContent = "Erreur lors du traitement";
+        database.classList.remove('waiting');
+        database.classList.remove('loading');
+        database.classList.add('error');
+    };
+
+    // The processing runs as a background job, followed through its SSE stream
     const response = await fetch(`/ajax/process_nlp/${source}`);
-    if (response.ok) {
+    if (!response.ok) {
+        onError();
+        return;
+    }
+    const job = await response.json();
+    const nlpEvt = new EventSource(`/ajax/jobs/${job.job_id}/stream`);
+
+    nlpEvt.addEventListener('error', (event) => {
+        console.error('SSE error', event);
+        nlpEvt.close();
+        onError();
+    });
+
+    nlpEvt.addEventListener('end', () => {
+        nlpEvt.close();
         database.classList.remove('waiting');
         progress.remove();
         initDB(source, database);
         // Send custom event
         const event = new Event('dataUpdate');
         document.dispatchEvent(event);
-
-    } else {
-        countLabel.textContent = "Erreur lors du traitement";
-        database.classList.remove('waiting');
-        database.classList.remove('loading');
-        database.classList.add('error');
-    }
+    });
 }
 
 
@@ -115,6 +131,9 @@ function startUpdate(source, database) {
         if (payload.count !== undefined) {
             progress.style.width = payload.progress + "%";
             countLabel.textContent = `${payload.count} offres trouvées`;
+            if (payload.keywords) {
+                countLabel.title = Object.entries(payload.keywords).map(([keyword, count]) => `${keyword} : ${count}`).join('\n');
+            }
         }
     };
 
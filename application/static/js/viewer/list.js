@@ -127,7 +127,13 @@ function createPopup(html) {
 
 function buildParamsURL(includeRefines=false) {
     const data = new FormData(searchForm);
-    data.append('salary', JSON.stringify(salarySlider.noUiSlider.get()));
+    // A handle at the end of the slider means no bound
+    const [salaryMin, salaryMax] = salarySlider.noUiSlider.get().map(Number);
+    const salaryRange = salarySlider.noUiSlider.options.range;
+    data.append('salary', JSON.stringify([
+        salaryMin > salaryRange.min ? salaryMin : null,
+        salaryMax < salaryRange.max ? salaryMax : null
+    ]));
     if (includeRefines) {
         const refine = [
             ...likes.map(offer_id => ({ type: 'like', offer_id })),
@@ -0,0 +1,209 @@
+from datetime import date
+from collections import Counter
+from dataclasses import replace
+from functools import partial
+from typing import Any, Generator
+import traceback
+import os
+
+from .custom.jobs import JobReporter
+from .custom.utils.concurrency import merge_concurrent
+from .custom.db.offer.models import Checkpoint
+
+
+# Offers committed per transaction while crawling
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 200))
+
+
+
+
+def _crawl(app, source:str, counts:Counter) -> Generator[tuple[str, Any, Any], Any, None]:
+    """Crawl one source, yielding ('start', expected, checkpoint), ('offer', offer, offset)... then ('end', None, None)
+    or ('error', message, None). Runs in its own thread, with the source client (session and rate policy)."""
+
+    try:
+        db_total = app.offer_db.get_total(source=source)
+
+        # Resume an interrupted crawl, or start a new one down to the latest known offer
+        checkpoint = app.offer_db.get_checkpoint(source)
+        if checkpoint is None:
+            checkpoint = Checkpoint(source=source, stop_date=app.offer_db.get_latest_date(source=source, isostring=True))
+        stop_date = date.fromisoformat(checkpoint.stop_date) if checkpoint.stop_date else None
+        # Offers already stored are skipped before their details are downloaded
+        known = partial(app.offer_db.known_ids, source)
+
+        api = app.apis[source]
+        api_total = api.get_total()
+        if source == 'NTNE':
+            iterator = api.iter_search(stop_date=stop_date, total=api_total, checkpoint=checkpoint, known=known, counts=counts)
+        else:
+            iterator = api.iter_search(stop_date=stop_date, checkpoint=checkpoint, known=known, counts=counts)
+
+        yield 'start', max((api_total or 0) - db_total, 1), checkpoint
+        for offer in iterator:
+            # The offset is read here since the sink commits the offer later
+            yield 'offer', offer, checkpoint.offset
+        yield 'end', None, None
+    except Exception as e:
+        traceback.print_exc()
+        yield 'error', str(e) or e.__class__.__name__, None
+
+
+def ingest(reporter:JobReporter, app, sources:str|list[str]) -> dict:
+    """Crawl sources concurrently down to their latest stored offer, and save the new offers (run as a background job).
+
+    Each source is crawled in its own thread with its own client, while this thread is the only one writing to the
+    database: offers are committed in batches per source, along with the source checkpoint. The refresh takes as
+    long as the slowest source.
+
+    Args:
+        reporter (JobReporter): Publishes `{count, progress, keywords, sources}` after each offer
+        app (AppContext): The application holding the clients and databases
+        sources (str | list[str]): Sources to crawl (eg. 'NTNE', ['NTNE', 'APEC'])
+
+    Returns:
+        dict: `{count, sources: {source: {count, error}}}`
+    """
+
+    sources = [sources] if isinstance(sources, str) else list(sources)
+    # New offers found by each search keyword, per source
+    counts = {source: Counter() for source in sources}
+    state = {source: {'count': 0, 'expected': 1, 'progress': 0, 'error': None} for source in sources}
+    checkpoints = {}
+    offsets = {} # offset of the last offer received from each source
+    batches = {source: [] for source in sources}
+
+    def flush(source:str, checkpoint:Checkpoint=None) -> None:
+        if batches[source]:
+            app.offer_db.add(batches[source], checkpoint=checkpoint)
+            batches[source] = []
+
+    def report() -> None:
+        count = sum(s['count'] for s in state.values())
+        expected = sum(s['expected'] for s in state.values())
+        keywords = sum(counts.values(), Counter())
+        reporter.report(count=count, progress=min(count / expected * 100, 100), keywords=dict(keywords), sources={source: dict(s) for source, s in state.items()})
+
+    report()
+    crawls = merge_concurrent({source: _crawl(app, source, counts[source]) for source in sources}, buffer=2 * INGEST_BATCH_SIZE)
+    for source, (kind, value, extra) in crawls:
+        match kind:
+            case 'start':
+                state[source]['expected'] = value
+                checkpoints[source] = extra
+            case 'offer':
+                batches[source].append(value)
+                offsets[source] = extra
+                state[source]['count'] += 1
+                state[source]['progress'] = min(state[source]['count'] / state[source]['expected'] * 100, 100)
+                # Commit each batch with the checkpoint, so an interrupted crawl resumes from here
+                # (the crawl may be ahead, the checkpoint is saved with the offset of the last offer of the batch)
+                if len(batches[source]) >= INGEST_BATCH_SIZE:
+                    flush(source, checkpoint=replace(checkpoints[source], offset=extra))
+            case 'end':
+                # Add remaining batch
+                flush(source)
+                app.offer_db.clear_checkpoint(source)
+                state[source]['progress'] = 100
+            case 'error':
+                # Keep what was found along with the checkpoint, so the next crawl resumes from here instead of
+                # stopping at the offers just stored (even when no batch was committed yet)
+                if batches[source]:
+                    flush(source, checkpoint=replace(checkpoints[source], offset=offsets[source]))
+                state[source]['error'] = value
+        report()
+
+    errors = {source: s['error'] for source, s in state.items() if s['error']}
+    if errors and len(errors) == len(sources):
+        raise Exception('; '.join(f'{source}: {error}' for source, error in errors.items()))
+    return {
+        'count': sum(s['count'] for s in state.values()),
+        'sources': {source: {'count': s['count'], 'error': s['error']} for source, s in state.items()}
+    }
+
+
+def process_nlp(reporter:JobReporter, app, source:str) -> dict:
+    """Compute the embeddings and clusters of the offers not processed yet (run as a background job)
+
+    Returns:
+        dict: `{count}` offers processed
+    """
+
+    ids, descriptions = app.offer_db.get_unprocessed(source)
+    if not ids:
+        return {'count': 0}
+
+    reporter.report(count=len(ids), step='tfidf')
+    emb_50d, emb_3d = app.nlp.tfidf.transform(descriptions, save=True)
+    reporter.report(count=len(ids), step='kmeans')
+    labels, clusters = app.nlp.kmeans.predict(emb_50d)
+
+    reporter.report(count=len(ids), step='save')
+    with app.offer_db.connect() as conn:
+        app.offer_db.add_nlp_many(conn, ids, emb_50d=emb_50d, emb_3d=emb_3d, labels=labels, clusters=clusters)
+
+    return {'count': len(ids)}
+
+
+def fit_kmeans(reporter:JobReporter, app, K:int) -> dict:
+    """Fit the KMeans model on the TF-IDF embeddings, name the clusters and save them (run as a background job)
+
+    Returns:
+        dict: The KMeans model metadata
+    """
+
+    ids = app.offer_db.get_table('OFFER', columns=['offer_id'])
+    emb_50ds = app.offer_db.get_table('TFIDF', columns=['emb_50d'], convert_blob=True)
+    X, tokens = app.nlp.tfidf.load_matrix()
+    reporter.report(step='fit')
+    labels, clusters = app.nlp.kmeans.fit_predict(X, emb_50ds, tokens, K=K)
+
+    # Create cluster names
+    reporter.report(step='naming')
+    template = [{
+        'cluster_id': c.id,
+        'main_tokens': c.main_tokens,
+        'cluster_name': None
+    } for c in clusters]
+    response = app.nlp.llm.request_json(
+        "Je fais du clustering d'offres d'emploi dans la data. Je me base sur les descriptions des offres. Trouve des noms pour mes clusters selon les tokens principaux.",
+        json_template=template
+    )
+    for c in response:
+        cluster_id = c['cluster_id']
+        clusters[cluster_id].name = c['cluster_name']
+
+    # Save data
+    reporter.report(step='save')
+    with app.offer_db.connect() as conn:
+        app.offer_db.clear_table(conn, 'CLUSTER')
+        app.offer_db.add_nlp_many(conn, ids, labels=labels, clusters=clusters)
+
+    return app.nlp.kmeans.metadata
+
+
+def fit_tfidf(reporter:JobReporter, app, min_df:int, max_df:float) -> dict:
+    """Fit the TF-IDF model on every offer description and save the embeddings (run as a background job)
+
+    Returns:
+        dict: The TF-IDF model metadata
+    """
+
+    ids = []
+    descriptions = []
+    for row in app.offer_db.iter_offers(columns=['offer_id', 'offer_description']):
+        ids.append(row['offer_id'])
+        descriptions.append(row['offer_description'])
+    total = app.offer_db.get_total(None)
+    if len(ids) != total:
+        # TFIDF is cleared before saving: never fit on a partial scan
+        raise Exception(f'Read {len(ids)} offers out of {total}, TF-IDF not fitted')
+    reporter.report(step='fit', count=len(ids))
+    emb_50d, emb_3d = app.nlp.tfidf.fit_transform(descriptions, min_df=min_df, max_df=max_df)
+
+    reporter.report(step='save', count=len(ids))
+    with app.offer_db.connect() as conn:
+        app.offer_db.clear_table(conn, 'TFIDF')
+        app.offer_db.add_nlp_many(conn, ids, emb_50d=emb_50d, emb_3d=emb_3d)
+
+    return app.nlp.tfidf.metadata
@@ -0,0 +1,43 @@
+import pytest
+
+from application.custom.utils.parser import ParseHTML
+from application._process.benchmark_parser import SAMPLES
+
+
+EDGE_CASES = [
+    "<div><p>Nested <span>inline <b>bold</b></span></p><ul><li>one</li><li><div>two</div></li></ul></div>",
+    "<section><article><h2>Title</h2><p>Paragraph</p></article><footer>End</footer></section>",
+    "&amp; &lt;b&gt; &eacute;t&eacute; &#233;t&#xE9; &nbsp;&euro; &notanentity; &amp",
+    "Line one<br>Line two<br/>Line three<br />",
+    "<p>Unclosed <b>tags <i>everywhere",
+    "<![CDATA[raw]]><p>after</p><!DOCTYPE html><?xml version='1.0'?>",
+    "   \n<p>\n  spaces\n\n around  </p>\n ",
+    "<p></p><br>",
+]
+
+
+@pytest.mark.parametrize('html', SAMPLES + EDGE_CASES)
+def test_stream_matches_soup(html):
+    assert ParseHTML._parse_stream(html) == ParseHTML(html, engine='soup')
+    assert ParseHTML(html) == ParseHTML(html, engine='soup')
+
+
+@pytest.mark.parametrize('html', ['', None])
+def test_empty_input(html):
+    assert ParseHTML(html) is None
+    assert ParseHTML(html, engine='soup') is None
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        ParseHTML('<p>text</p>', engine='lxml')
+
+
+def test_cache_returns_the_same_text():
+    ParseHTML._parse_cached.cache_clear()
+    html = SAMPLES[0]
+    first = ParseHTML(html)
+    second = ParseHTML(html)
+    info = ParseHTML._parse_cached.cache_info()
+    assert first == second == ParseHTML._parse_stream(html)
+    assert (info.hits, info.misses) == (1, 1)
@@ -0,0 +1,91 @@
+import pytest
+
+from application.custom.api import BaseAPI, RatePolicy, CircuitOpenError
+
+
+
+
+class FakeResponse:
+
+    def __init__(self, status_code:int) -> None:
+        self.status_code = status_code
+        self.headers = {}
+        self.content = b''
+
+
+class FakeSession:
+
+    """Answers every request with the next status of `statuses`, or raises it if it is an exception"""
+
+    def __init__(self, *statuses) -> None:
+        self.statuses = list(statuses)
+
+    def request(self, method:str, url:str, **kwargs) -> FakeResponse:
+        status = self.statuses.pop(0)
+        if isinstance(status, BaseException):
+            raise status
+        return FakeResponse(status)
+
+
+class FakeAPI(BaseAPI):
+
+    def get_total(self):
+        return 0
+
+    def iter_search(self):
+        return iter(())
+
+
+URL = 'https://example.org/offers'
+
+
+def make_api(*statuses) -> FakeAPI:
+    policy = RatePolicy(failure_threshold=1, reset_timeout=0, retries=0)
+    api = FakeAPI('https://example.org', policy=policy)
+    api.session = FakeSession(*statuses)
+    return api
+
+
+def test_congestion_on_trial_does_not_lock_the_host():
+    host = RatePolicy(failure_threshold=1, reset_timeout=0).host(URL)
+    host.breaker.failure()
+    assert host.breaker.allow() # half-open trial
+    host.congestion()
+    assert not host.breaker.trial
+    assert host.breaker.allow()
+
+
+def test_429_on_half_open_trial():
+    api = make_api(500, 429, 200)
+    breaker = api.policy.host(URL).breaker
+
+    assert api._safe_requests(URL, raise_status=False) is None
+    assert breaker.state == 'half-open'
+    # The trial is throttled: the host stays open, but the next request is let through as a new trial
+    assert api._safe_requests(URL, raise_status=False) is None
+    assert not breaker.trial
+    assert api._safe_requests(URL) is None
+    assert breaker.state == 'closed'
+
+
+def test_unexpected_error_ends_the_trial():
+    api = make_api(500, KeyError('boom'), 200)
+    host = api.policy.host(URL)
+
+    api._safe_requests(URL, raise_status=False)
+    with pytest.raises(KeyError):
+        api._safe_requests(URL)
+    assert not host.breaker.trial
+    assert host.limiter.in_flight == 0
+    assert api._safe_requests(URL) is None
+    assert host.breaker.state == 'closed'
+
+
+def test_open_circuit_refuses_requests():
+    api = make_api(500)
+    api.policy.reset_timeout = 60
+    api.policy._hosts.clear()
+
+    api._safe_requests(URL, raise_status=False)
+    with pytest.raises(CircuitOpenError):
+        api._safe_requests(URL)